@@ -0,0 +1,80 @@
+import io
+import os
+import time
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+# already compressed data, deflating it again only burns CPU
+STORED_EXTENSIONS = {".mp4", ".webm", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".woff", ".woff2", ".gz", ".zip"}
+
+
+class ZipSink(io.RawIOBase):
+    """Unseekable write target for ZipFile, the bytes written so far are taken with ``drain``."""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buffer += b
+        return len(b)
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def list_archive_entries(base_dir):
+    """Snapshot of (path, stat) pairs in the order shutil.make_archive adds them, stat is None for directories."""
+    base_dir = os.path.normpath(base_dir)
+    entries = [(base_dir, None)]
+    for dirpath, dirnames, filenames in os.walk(base_dir):
+        for name in sorted(dirnames):
+            entries.append((os.path.join(dirpath, name), None))
+        for name in filenames:
+            path = os.path.normpath(os.path.join(dirpath, name))
+            if os.path.isfile(path):
+                entries.append((path, os.stat(path)))
+    return entries
+
+
+def zipinfo_from_stat(path, stat):
+    arcname = os.path.normpath(path).lstrip(os.sep)
+    date_time = time.localtime(stat.st_mtime)[0:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    zinfo = zipfile.ZipInfo(arcname, date_time)
+    zinfo.external_attr = (stat.st_mode & 0xFFFF) << 16
+    zinfo.file_size = stat.st_size
+    return zinfo
+
+
+def stream_archive(entries, chunk_size=CHUNK_SIZE):
+    """Yield a zip archive of ``entries`` chunk by chunk without staging it anywhere."""
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for path, stat in entries:
+            if stat is None:
+                zf.write(path, path)
+                continue
+            zinfo = zipinfo_from_stat(path, stat)
+            if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+            try:
+                src = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            with src, zf.open(zinfo, "w") as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    dst.write(chunk)
+                    if len(sink.buffer) >= chunk_size:
+                        yield sink.drain()
+        if sink.buffer:
+            yield sink.drain()
+    yield sink.drain()
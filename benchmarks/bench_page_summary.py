@@ -0,0 +1,92 @@
+"""Compares loading browsertime.pageSummary.json whole with the field-projecting reader.
+
+    python benchmarks/bench_page_summary.py [size_mb]
+"""
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_summary import PAGE_SUMMARY_FIELDS, ijson, orjson, read_page_summary  # noqa: E402
+
+LOOPS = 5
+
+
+def synthetic_page_summary(size_mb):
+    # browserScripts carry the bulk of a real summary: resource timings, page info, custom scripts
+    padding = int(size_mb * 1024 * 1024 / LOOPS / 120)
+    browser_scripts = [{
+        "browser": {"userAgent": "Mozilla/5.0", "resources": [
+            {"name": f"https://example.com/static/{n}.js", "duration": n * 1.5, "transferSize": n * 10}
+            for n in range(padding)]},
+        "timings": {"ttfb": 120 + i, "firstPaint": 300.5 + i,
+                    "navigationTiming": {"domContentLoadedEventEnd": 800 + i, "domComplete": 1500 + i}},
+    } for i in range(LOOPS)]
+    return {
+        "timestamps": [f"2026-10-18T10:00:0{i}.000Z" for i in range(LOOPS)],
+        "fullyLoaded": [2000 + i for i in range(LOOPS)],
+        "visualMetrics": [{"SpeedIndex": 900 + i, "FirstVisualChange": 400 + i, "LastVisualChange": 1900 + i,
+                           "VisualProgress": {str(ms): ms // 30 for ms in range(0, 3000, 100)}}
+                          for i in range(LOOPS)],
+        "browserScripts": browser_scripts,
+        "googleWebVitals": [{"firstContentfulPaint": 350 + i, "largestContentfulPaint": 1200 + i,
+                             "cumulativeLayoutShift": 0.01 * i, "totalBlockingTime": 50 + i}
+                            for i in range(LOOPS)],
+    }
+
+
+def check_empty_arrays():
+    """Empty arrays are read as empty lists by every backend, like json.loads does."""
+    summary = synthetic_page_summary(0)
+    summary["googleWebVitals"] = []
+    summary["visualMetrics"] = []
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(summary, f)
+    try:
+        for backend in ["json"] + (["orjson"] if orjson else []) + (["ijson"] if ijson else []):
+            result = read_page_summary(f.name, PAGE_SUMMARY_FIELDS, backend)
+            assert result["googleWebVitals"] == [], f"{backend} drops an empty googleWebVitals"
+            assert result["visualMetrics"] == [], f"{backend} drops an empty visualMetrics"
+            assert len(result["browserScripts"]) == LOOPS, f"{backend} misreads browserScripts"
+    finally:
+        os.remove(f.name)
+
+
+def legacy(json_file):
+    with open(json_file, "r") as f:
+        return json.loads(f.read())
+
+
+def measure(fn, *args):
+    start = default_timer()
+    result = fn(*args)
+    elapsed = default_timer() - start
+    # tracemalloc slows parsing down a lot, so memory is measured on a separate run
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    check_empty_arrays()
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(synthetic_page_summary(size_mb), f)
+    try:
+        print(f"pageSummary size: {os.path.getsize(f.name) / 1024 / 1024:.1f}MB")
+        _, elapsed, peak = measure(legacy, f.name)
+        print(f"{'json.loads (legacy)':24} {elapsed * 1000:8.1f}ms  peak {peak / 1024 / 1024:7.1f}MB")
+        expected = None
+        for backend in ["json"] + (["orjson"] if orjson else []) + (["ijson"] if ijson else []):
+            result, elapsed, peak = measure(read_page_summary, f.name, PAGE_SUMMARY_FIELDS, backend)
+            expected = expected or result
+            assert result == expected, f"{backend} projection differs"
+            print(f"{'projected ' + backend:24} {elapsed * 1000:8.1f}ms  peak {peak / 1024 / 1024:7.1f}MB")
+    finally:
+        os.remove(f.name)
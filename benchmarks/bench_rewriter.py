@@ -0,0 +1,122 @@
+"""Compares the single-pass link rewriter with the chained str.replace implementation it replaced.
+
+    python benchmarks/bench_rewriter.py [size_mb]
+"""
+import os
+import re
+import sys
+from timeit import default_timer
+from types import SimpleNamespace
+
+os.environ.setdefault("integrations", '{"system": {"s3_integration": {"integration_id": 1, "is_local": true}}}')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import page_media_uploads, s3_config, update_page_results_html  # noqa: E402
+
+LOOPS = 5
+REPORT_BUCKET = "http://galloper/api/v1/artifacts/artifact/1/reports"
+STATIC_BUCKET = "http://galloper/api/v1/artifacts/artifact/1/sitespeedstatic"
+TIMESTAMP = "18Oct2026_10:00:00"
+
+
+def legacy_update_page_results_html(html, report_bucket, static_bucket, page_name, timestamp, loops, prefix):
+    html = html.replace(f'<li><a href="{prefix}assets.html">Assets</a></li>',
+                        f'<li><a href="{report_bucket}/{timestamp}_assets.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}">Assets</a></li> <li><a href="{timestamp}_distributed_report.zip?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}">Report</a></li>')
+    html = html.replace(f'href="{prefix}css/index.min.css"', f'href="{static_bucket}/index.min.css?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'href="{prefix}img/ico/sitespeed.io-144.png"', f'href="{static_bucket}/sitespeed.io-144.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'href="{prefix}img/ico/sitespeed.io-114.png"', f'href="{static_bucket}/sitespeed.io-114.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'href="{prefix}img/ico/sitespeed.io-72.png"', f'href="{static_bucket}/sitespeed.io-72.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'href="{prefix}img/ico/sitespeed.io.ico"', f'href="{static_bucket}/sitespeed.io.ico?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}img/sitespeed.io-logo.png"', f'src="{static_bucket}/sitespeed.io-logo.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}img/coach.png"', f'src="{static_bucket}/coach.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}js/perf-cascade.min.js"', f'src="{static_bucket}/perf-cascade.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}js/sortable.min.js"', f'src="{static_bucket}/sortable.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}js/chartist.min.js"', f'src="{static_bucket}/chartist.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}js/chartist-plugin-axistitle.min.js"',
+                        f'src="{static_bucket}/chartist-plugin-axistitle.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}js/chartist-plugin-tooltip.min.js"',
+                        f'src="{static_bucket}/chartist-plugin-tooltip.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}js/chartist-plugin-legend.min.js"',
+                        f'src="{static_bucket}/chartist-plugin-legend.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'src="{prefix}js/video.core.novtt.min.js"', f'src="{static_bucket}/video.core.novtt.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+    html = html.replace(f'href="{prefix}help.html', f'href="{report_bucket}/{timestamp}_help.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}')
+
+    for html_file in ["index.html", "detailed.html", "pages.html", "domains.html", "toplist.html", "settings.html"]:
+        html = html.replace(f'href="{prefix}{html_file}"', f'href="{report_bucket}/{timestamp}_{html_file}?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"') if "integration_id" not in f'href="{prefix}{html_file}"' else html
+    for i in range(1, loops + 1):
+        html = html.replace(f'href="./{i}.html"', f'href="{report_bucket}/{page_name}_{timestamp}_{i}.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"') if "integration_id" not in f'href="./{i}.html"' else html
+        for data_file_path in [f"data/screenshots/{i}/", "data/video/", f"data/filmstrip/{i}/"]:
+            html = html.replace(data_file_path, f'{report_bucket}/{page_name}_{timestamp}_') if "integration_id" not in data_file_path else html
+    html = html.replace('href="metrics.html"', f'href="{report_bucket}/{page_name}_{timestamp}_metrics.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+
+    # Links for pages
+    links = re.findall('href="pages/(.+?)/index.html"', html)
+    for each in links:
+        try:
+            link = f'href="pages/{each}/index.html"'
+            page_name = link.split("/")[-2]
+            html = html.replace(f'href="pages/{each}/index.html"',
+                                f'href="{report_bucket}/{page_name}_{timestamp}_index.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"') if "integration_id" not in f'href="pages/{each}/index.html"' else html
+        except:
+            print(f"failed to update {each} link")
+    return html
+
+
+def synthetic_html(prefix, size_mb, media=True):
+    """``media=False`` leaves out the frames and screenshots, the only links named per loop since the legacy code."""
+    head = [f'<link href="{prefix}css/index.min.css" rel="stylesheet">',
+            f'<link href="{prefix}img/ico/sitespeed.io-144.png"><link href="{prefix}img/ico/sitespeed.io.ico">',
+            f'<img src="{prefix}img/sitespeed.io-logo.png"><img src="{prefix}img/coach.png">',
+            f'<li><a href="{prefix}assets.html">Assets</a></li><a href="{prefix}help.html#metrics">help</a>',
+            ''.join(f'<a href="{prefix}{f}">{f}</a>' for f in ["index.html", "detailed.html", "pages.html",
+                                                              "domains.html", "toplist.html", "settings.html"]),
+            ''.join(f'<script src="{prefix}js/{f}"></script>' for f in ["perf-cascade.min.js", "sortable.min.js",
+                                                                       "chartist.min.js", "video.core.novtt.min.js"]),
+            '<a href="metrics.html">Metrics</a>']
+    block = []
+    for i in range(1, LOOPS + 1):
+        block.append(f'<a href="./{i}.html">Run {i}</a><video src="data/video/{i}.mp4"></video>')
+        if media:
+            block.append(f'<img src="data/screenshots/{i}/afterPageCompleteCheck.png">'
+                         + ''.join(f'<img src="data/filmstrip/{i}/ms_{ms:06d}.jpg">' for ms in range(0, 3000, 100)))
+    block.append(''.join(f'<tr><td><a href="pages/www_example_com/page_{n}/index.html">page {n}</a></td>'
+                         f'<td>{n * 17}</td></tr>' for n in range(20)))
+    block.append('<div class="filler">' + 'lorem ipsum dolor sit amet ' * 400 + '</div>\n')
+    block = ''.join(block)
+    repeats = max(1, int(size_mb * 1024 * 1024 / len(block)))
+    return ''.join(head) + block * repeats
+
+
+def check_loop_names():
+    """Frames and screenshots link to the per-loop names they are uploaded under, videos keep their names."""
+    loops = [SimpleNamespace(loop=i, filmstrip=[f"ms_{ms:06d}.jpg" for ms in range(0, 500, 100)],
+                             screenshots=["afterPageCompleteCheck.png"], video=f"{i}.mp4") for i in range(1, LOOPS + 1)]
+    page = SimpleNamespace(path="/results/pages/www_example_com/", page_name="www_example_com", loops=loops)
+    uploaded = {f"{REPORT_BUCKET}/{file_name}" for file_name, _ in page_media_uploads(page, TIMESTAMP)}
+    html = ''.join(f'<img src="{source[len(page.path):]}">' for _, source in page_media_uploads(page, TIMESTAMP))
+    html = update_page_results_html(html, REPORT_BUCKET, STATIC_BUCKET, page.page_name, TIMESTAMP, LOOPS, "")
+    linked = set(re.findall('src="([^"]*)"', html))
+    assert linked == uploaded, f"links without an upload: {sorted(linked - uploaded)[:3]}"
+    assert len(linked) == LOOPS * 7, "frames or screenshots of different loops share a name"
+
+
+def bench(fn, html, prefix, rounds):
+    start = default_timer()
+    for _ in range(rounds):
+        result = fn(html, REPORT_BUCKET, STATIC_BUCKET, "www_example_com", TIMESTAMP, LOOPS, prefix)
+    return result, (default_timer() - start) / rounds
+
+
+if __name__ == "__main__":
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    check_loop_names()
+    for prefix in ["../../../", "../../../../", ""]:
+        # every link but the per-loop frames and screenshots is rewritten like the legacy code does
+        html = synthetic_html(prefix, 0.5, media=False)
+        assert bench(legacy_update_page_results_html, html, prefix, 1)[0] == \
+            bench(update_page_results_html, html, prefix, 1)[0], f"output differs for prefix {prefix!r}"
+        html = synthetic_html(prefix, size_mb)
+        _, legacy_time = bench(legacy_update_page_results_html, html, prefix, 3)
+        _, current_time = bench(update_page_results_html, html, prefix, 3)
+        print(f"prefix={prefix!r:16} size={len(html) / 1024 / 1024:.1f}MB legacy={legacy_time * 1000:.1f}ms "
+              f"single-pass={current_time * 1000:.1f}ms speedup={legacy_time / current_time:.1f}x")
@@ -0,0 +1,211 @@
+"""Local stand-in for the Galloper endpoints the results processing talks to.
+
+    python benchmarks/galloper_stub.py --port 8080
+
+Uploaded artifacts are kept in memory so they can be downloaded again (the static manifest, the test
+bundle), every request is counted with the bytes it carried in each direction.
+
+With --fail-rate, that share of artifact uploads fails: "reset" drops the connection part way through
+the body, "503" takes the body and answers 503, "mixed" picks one of them at random.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+from timeit import default_timer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILE_NAME = re.compile(rb'filename="([^"]*)"')
+
+
+def endpoint(path):
+    if "/artifacts/artifacts/" in path:
+        return "artifact_upload"
+    if "/artifacts/artifact/" in path:
+        return "artifact_download"
+    for name in ("thresholds", "report_status", "reports", "run_task"):
+        if f"/ui_performance/{name}/" in path or f"/tasks/{name}/" in path:
+            return name
+    if "issue" in path:
+        return "issues"
+    return "other"
+
+
+class GalloperStub(object):
+    """Serves the artifact, thresholds, report_status, reports, tasks and issues endpoints on a local port."""
+
+    def __init__(self, port=0, thresholds=None, fail_rate=0.0, fail_mode="mixed", seed=1):
+        self.thresholds = thresholds or []
+        self.fail_rate = fail_rate
+        self.fail_mode = fail_mode
+        self.random = random.Random(seed)
+        self.artifacts = {}
+        self.reports = []
+        # when every report arrived, on the default_timer clock
+        self.report_times = []
+        self.lock = threading.Lock()
+        self.reset()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(self))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.failures = 0
+
+    def count(self, kind, bytes_in, bytes_out):
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def stats(self):
+        with self.lock:
+            return {"requests": sum(self.requests.values()), "by_endpoint": dict(self.requests),
+                    "bytes_in": self.bytes_in, "bytes_out": self.bytes_out, "failures": self.failures}
+
+    def failure(self, method, path):
+        """How this request is going to fail, None when it is served."""
+        if method != "POST" or endpoint(path) != "artifact_upload" or not self.fail_rate:
+            return None
+        with self.lock:
+            if self.random.random() >= self.fail_rate:
+                return None
+            self.failures += 1
+            if self.fail_mode == "mixed":
+                return self.random.choice(["reset", "503"])
+            return self.fail_mode
+
+    def store(self, bucket, content_type, body):
+        boundary = content_type.split("boundary=")[-1].strip('"').encode()
+        for part in body.split(b"--" + boundary)[1:-1]:
+            headers, _, content = part.partition(b"\r\n\r\n")
+            name = FILE_NAME.search(headers)
+            if name:
+                with self.lock:
+                    self.artifacts[(bucket, name.group(1).decode())] = content[:-2]
+
+    def answer(self, method, path, body, content_type, etag=None):
+        """Return (status, body) for a request, downloads answer 304 when ``etag`` is the current one."""
+        parts = path.split("?")[0].rstrip("/").split("/")
+        kind = endpoint(path)
+        if kind == "artifact_upload" and method == "POST":
+            self.store(parts[-1], content_type, body)
+            return 200, {"message": "Done"}
+        if kind == "artifact_download" and method == "GET":
+            data = self.artifacts.get((parts[-2], parts[-1]))
+            if data is None:
+                return 404, {"error": "not found"}
+            return (304, b"") if etag == artifact_etag(data) else (200, data)
+        if kind == "thresholds":
+            return 200, self.thresholds
+        if kind == "reports":
+            with self.lock:
+                self.reports.append(json.loads(body or b"{}"))
+                self.report_times.append(default_timer())
+            return 200, {"message": "updated"}
+        if kind == "issues" and method == "GET":
+            return 200, {"total": 0, "rows": []}
+        return 200, {"message": "ok"}
+
+
+def artifact_etag(data):
+    # the quoted md5 S3 gives objects uploaded in one part
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out in separate writes, Nagle would hold the body back for a delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def read_body(self):
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        break
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                return b"".join(chunks)
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def handle_request(self):
+            failure = stub.failure(self.command, self.path)
+            if failure == "reset":
+                # take what has arrived of the body and drop the connection, like a proxy giving up mid-upload
+                self.rfile.read1(65536)
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            body = self.read_body()
+            if failure == "503":
+                status, data = 503, {"error": "injected failure"}
+            else:
+                status, data = stub.answer(self.command, self.path, body, self.headers.get("Content-Type", ""),
+                                           self.headers.get("If-None-Match"))
+            if isinstance(data, bytes):
+                content_type = "application/octet-stream"
+            else:
+                content_type = "application/json"
+                data = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            if endpoint(self.path) == "artifact_download" and status in (200, 304):
+                self.send_header("ETag", self.headers.get("If-None-Match") if status == 304 else artifact_etag(data))
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            stub.count(endpoint(self.path), len(body), len(data))
+
+        do_GET = do_POST = do_PUT = handle_request
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--thresholds", help="json file with the thresholds to serve")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of artifact uploads that fail")
+    parser.add_argument("--fail-mode", choices=["reset", "503", "mixed"], default="mixed")
+    args = parser.parse_args()
+    thresholds = None
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    stub = GalloperStub(args.port, thresholds, args.fail_rate, args.fail_mode)
+    print(f"Galloper stub on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(stub.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Runs results_processing.py end to end against synthetic results and the local Galloper stub.
+
+    python benchmarks/run_benchmarks.py [scenario ...] [--repeat 3] [--json out.json]
+
+Every scenario gets a fresh synthetic tree under --root ($SITESPEED_RESULTS by default, a temporary
+directory when it is not set). Any other environment variable (UPLOAD_WORKERS, PAGE_WORKERS, ...)
+is passed through to results_processing.py, so configurations can be compared run against run.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from galloper_stub import GalloperStub  # noqa: E402
+from synthetic_results import SCRIPT_DIR, generate  # noqa: E402
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = {
+    "small": dict(pages=5, loops=3, frames=20, html_kb=100, json_kb=200, video_kb=200),
+    "medium": dict(pages=20, loops=3, frames=40, html_kb=300, json_kb=800, video_kb=400),
+    "large": dict(pages=50, loops=5, frames=60, html_kb=500, json_kb=1500, video_kb=800),
+}
+THRESHOLDS = [
+    {"scope": "all", "target": "load_time", "aggregation": "pct95", "comparison": "gte", "value": 4000},
+    {"scope": "every", "target": "speed_index", "aggregation": "max", "comparison": "gte", "value": 3000},
+    {"scope": "page_0", "target": "time_to_first_byte", "aggregation": "max", "comparison": "gt", "value": 1000},
+]
+
+
+def tree_size(path):
+    return sum(os.path.getsize(os.path.join(dirpath, name)) for dirpath, _, names in os.walk(path) for name in names)
+
+
+def processing_env(stub, root, work_dir, **extra):
+    """Environment of a results_processing.py run against the stub, the current environment passes through."""
+    env = dict(os.environ)
+    env.update({
+        "GALLOPER_URL": stub.url, "GALLOPER_PROJECT_ID": "1", "REPORT_ID": "1", "token": "benchmark",
+        "JOB_NAME": "benchmark", "ENV": "benchmark", "SITESPEED_RESULTS": root,
+        "integrations": json.dumps({"system": {"s3_integration": {"integration_id": 1, "is_local": True}}}),
+        "STATIC_MANIFEST_DIR": work_dir + "/", "STATIC_REFRESH": "true",
+        "TESTS_READER_TIMINGS": os.path.join(work_dir, "tests_reader_timings.json"),
+    })
+    env.update(extra)
+    return env
+
+
+def start_processing(env, work_dir, loops, log):
+    return subprocess.Popen([sys.executable, os.path.join(REPO, "results_processing.py"), "1",
+                             SCRIPT_DIR.replace("_", "."), str(loops), "max"],
+                            cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def run_scenario(name, params, root, work_dir, stub):
+    run_dir = generate(root, **params)
+    size = tree_size(run_dir)
+    env = processing_env(stub, root, work_dir)
+    stub.reset()
+    log_file = os.path.join(work_dir, f"{name}.log")
+    start = default_timer()
+    with open(log_file, "w") as log:
+        code = start_processing(env, work_dir, params["loops"], log).wait()
+    wall = default_timer() - start
+    # when the report was final, the uploads left after it are media and archives
+    report = stub.report_times[-1] - start if stub.report_times and stub.report_times[-1] > start else None
+    stats = stub.stats()
+    phases = {}
+    timings = [data for (bucket, file_name), data in stub.artifacts.items() if file_name.endswith("_timings.json")]
+    if timings:
+        phases = {phase: each["wall"] for phase, each in json.loads(timings[-1])["phases"].items()}
+    artifacts = len(stub.artifacts)
+    stub.artifacts.clear()
+    return {"scenario": name, "exit_code": code, "tree_bytes": size, "wall": round(wall, 3),
+            "report": round(report, 3) if report is not None else None,
+            "requests": stats["requests"], "bytes_in": stats["bytes_in"], "bytes_out": stats["bytes_out"],
+            "by_endpoint": stats["by_endpoint"], "failures": stats["failures"], "artifacts": artifacts,
+            "phases": phases, "log": log_file}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", default=["small", "medium"], help=f"any of {', '.join(SCENARIOS)}")
+    parser.add_argument("--root", default=os.environ.get("SITESPEED_RESULTS"),
+                        help="where the synthetic results are written, $SITESPEED_RESULTS by default")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario, the median run is reported")
+    parser.add_argument("--phases", action="store_true", help="print the slowest phases of every scenario")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="share of artifact uploads the stub fails, to exercise the retries")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="results-benchmark-")
+    root = args.root or os.path.join(work_dir, "sitespeed-result")
+    stub = GalloperStub(thresholds=THRESHOLDS, fail_rate=args.fail_rate).start()
+    results = []
+    print(f"{'scenario':<10}{'tree MB':>10}{'wall s':>10}{'report s':>10}{'requests':>10}{'sent MB':>10}{'MB/s':>10}")
+    try:
+        for name in args.scenarios:
+            runs = sorted((run_scenario(name, SCENARIOS[name], root, work_dir, stub) for _ in range(args.repeat)),
+                          key=lambda run: run["wall"])
+            result = runs[len(runs) // 2]
+            result["walls"] = [run["wall"] for run in runs]
+            results.append(result)
+            print(f"{name:<10}{result['tree_bytes'] / 2 ** 20:>10.1f}{result['wall']:>10.3f}"
+                  f"{result['report'] if result['report'] is not None else float('nan'):>10.3f}{result['requests']:>10}"
+                  f"{result['bytes_in'] / 2 ** 20:>10.1f}{result['bytes_in'] / 2 ** 20 / result['wall']:>10.1f}"
+                  + (f"  exit code {result['exit_code']}, see {result['log']}" if result["exit_code"] else "")
+                  + (f"  {result['failures']} failures injected, {result['artifacts']} artifacts stored"
+                     if args.fail_rate else ""))
+            if args.phases:
+                for phase, wall in sorted(result["phases"].items(), key=lambda each: -each[1])[:8]:
+                    print(f"    {phase:<36}{wall:>10.3f}")
+            if args.repeat > 1:
+                print(f"    runs: {', '.join(f'{wall:.3f}' for wall in result['walls'])}, "
+                      f"median {median(result['walls']):.3f}")
+    finally:
+        stub.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
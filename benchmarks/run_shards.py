@@ -0,0 +1,100 @@
+"""Runs a sharded results processing next to a single one and checks that both report the same.
+
+    python benchmarks/run_shards.py [--shards 3] [--scenario small]
+
+The synthetic tree is split into contiguous shards of pages, like shards.py splits a url list, every shard is
+processed by its own local process and the merge step reports the run. The report (results, thresholds,
+status) and the CSV rows must be identical to the ones of the single run, the file names in the CSV aside.
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from galloper_stub import GalloperStub  # noqa: E402
+from run_benchmarks import SCENARIOS, THRESHOLDS, processing_env, start_processing  # noqa: E402
+from synthetic_results import RUN_DIR, SCRIPT_DIR, generate  # noqa: E402
+
+
+def split_tree(run_dir, shards, shards_dir):
+    """Hard link the tree into a results root per shard, the pages in contiguous parts of finishing order."""
+    pages_dir = os.path.join(run_dir, "pages")
+    pages = sorted((os.path.join(pages_dir, domain, page) for domain in os.listdir(pages_dir)
+                    for page in os.listdir(os.path.join(pages_dir, domain))), key=os.path.getmtime)
+    size = -(-len(pages) // shards)
+    roots = []
+    for shard, start in enumerate(range(0, len(pages), size)):
+        root = os.path.join(shards_dir, str(shard), "sitespeed-result")
+        shard_run = os.path.join(root, SCRIPT_DIR, RUN_DIR)
+        shutil.copytree(run_dir, shard_run, ignore=shutil.ignore_patterns("pages"), copy_function=os.link)
+        for page in pages[start:start + size]:
+            shutil.copytree(page, os.path.join(shard_run, os.path.relpath(page, run_dir)), copy_function=os.link)
+        roots.append(root)
+    return roots
+
+
+def report_of(stub):
+    report = dict(stub.reports[-1])
+    report.pop("time")
+    csv = gzip.decompress(stub.artifacts[("benchmark", "1.csv.gz")]).decode("utf-8").splitlines()
+    # the file names carry the timestamp of the process that uploaded the page
+    return report, [row.rsplit(",", 1)[0] for row in csv]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, default=3)
+    parser.add_argument("--scenario", default="small", help=f"any of {', '.join(SCENARIOS)}")
+    args = parser.parse_args()
+
+    params = SCENARIOS[args.scenario]
+    work_dir = tempfile.mkdtemp(prefix="results-shards-")
+    root = os.path.join(work_dir, "sitespeed-result")
+    shards_dir = os.path.join(work_dir, "shards") + "/"
+    run_dir = generate(root, **params)
+    stub = GalloperStub(thresholds=THRESHOLDS).start()
+    try:
+        start = default_timer()
+        with open(os.path.join(work_dir, "single.log"), "w") as log:
+            code = start_processing(processing_env(stub, root, work_dir), work_dir, params["loops"], log).wait()
+        single_wall = default_timer() - start
+        single = report_of(stub)
+
+        roots = split_tree(run_dir, args.shards, shards_dir)
+        start = default_timer()
+        workers = []
+        for shard, shard_root in enumerate(roots):
+            log = open(os.path.join(shards_dir, str(shard), "shard.log"), "w")
+            env = processing_env(stub, shard_root, work_dir, SHARD_INDEX=str(shard), SHARDS_DIR=shards_dir)
+            workers.append((start_processing(env, work_dir, params["loops"], log), log))
+        codes = []
+        for worker, log in workers:
+            codes.append(worker.wait())
+            log.close()
+        with open(os.path.join(work_dir, "merge.log"), "w") as log:
+            env = processing_env(stub, root, work_dir, RESULTS_MERGE="true", SHARDS_DIR=shards_dir)
+            codes.append(start_processing(env, work_dir, params["loops"], log).wait())
+        sharded_wall = default_timer() - start
+        sharded = report_of(stub)
+    finally:
+        stub.stop()
+
+    print(f"single run  {single_wall:8.3f}s, exit code {code}")
+    print(f"{len(roots)} shards    {sharded_wall:8.3f}s, exit codes {codes}")
+    same_report, same_csv = single[0] == sharded[0], single[1] == sharded[1]
+    print(f"report {'identical' if same_report else 'DIFFERS'}, "
+          f"{len(sharded[1]) - 1} CSV rows {'identical' if same_csv else 'DIFFER'}, logs in {work_dir}")
+    if not same_report:
+        print(json.dumps(single[0], sort_keys=True)[:2000])
+        print(json.dumps(sharded[0], sort_keys=True)[:2000])
+    sys.exit(0 if same_report and same_csv else 1)
+
+
+if __name__ == "__main__":
+    main()
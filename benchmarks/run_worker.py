@@ -0,0 +1,104 @@
+"""Runs the same test a few times as separate processes and through one worker_service.py process.
+
+    python benchmarks/run_worker.py [--runs 5] [--scenario small]
+
+sitespeed.io is replaced by a copy of the synthetic tree, so the times are the interpreter startup and results
+processing of every run. The reports of the worker runs must be identical to the one of a separate process.
+"""
+import argparse
+import json
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from galloper_stub import GalloperStub  # noqa: E402
+from run_benchmarks import REPO, SCENARIOS, THRESHOLDS, processing_env, start_processing  # noqa: E402
+from run_shards import report_of  # noqa: E402
+from synthetic_results import SCRIPT_DIR, generate  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def call(url, descriptor=None):
+    data = json.dumps(descriptor).encode("utf-8") if descriptor is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, data=data)) as resp:
+        return json.loads(resp.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scenario", default="small", help=f"any of {', '.join(SCENARIOS)}")
+    args = parser.parse_args()
+
+    params = SCENARIOS[args.scenario]
+    work_dir = tempfile.mkdtemp(prefix="results-worker-")
+    root = os.path.join(work_dir, "sitespeed-result")
+    template = os.path.join(work_dir, "template")
+    generate(template, **params)
+    # stands in for sitespeed.io, the options of the run are ignored
+    copy_tree = f"sh -c {shlex.quote(f'rm -rf {root} && cp -r {template} {root}')} sitespeed"
+    stub = GalloperStub(thresholds=THRESHOLDS).start()
+    worker = None
+    try:
+        env = processing_env(stub, root, work_dir, STATIC_REFRESH="false")
+        cold = []
+        with open(os.path.join(work_dir, "cold.log"), "w") as log:
+            for _ in range(args.runs):
+                start = default_timer()
+                subprocess.run(shlex.split(copy_tree), check=True)
+                start_processing(env, work_dir, params["loops"], log).wait()
+                cold.append(default_timer() - start)
+        expected = report_of(stub)
+
+        port = free_port()
+        log = open(os.path.join(work_dir, "worker.log"), "w")
+        worker = subprocess.Popen([sys.executable, os.path.join(REPO, "worker_service.py")], cwd=work_dir,
+                                  env=dict(env, WORKER_PORT=str(port), SITESPEED_CMD=copy_tree),
+                                  stdout=log, stderr=subprocess.STDOUT)
+        url = f"http://127.0.0.1:{port}/runs"
+        for _ in range(100):
+            try:
+                call(url)
+                break
+            except OSError:
+                time.sleep(0.05)
+        warm, same = [], True
+        for _ in range(args.runs):
+            start = default_timer()
+            run = call(url, {"test_id": "1", "script": SCRIPT_DIR.replace("_", "."), "loops": params["loops"],
+                             "aggregation": "max"})
+            while call(url)[run["id"] - 1]["status"] in ("queued", "running"):
+                time.sleep(0.01)
+            warm.append(default_timer() - start)
+            same = same and report_of(stub) == expected
+        runs = call(url)
+    finally:
+        if worker is not None:
+            worker.terminate()
+            worker.wait()
+        stub.stop()
+
+    print(f"process per run {sum(cold) / len(cold):8.3f}s per run, first {cold[0]:.3f}s")
+    print(f"worker          {sum(warm) / len(warm):8.3f}s per run, first {warm[0]:.3f}s")
+    print(f"worker runs {[run['status'] for run in runs]}, reports {'identical' if same else 'DIFFER'}, "
+          f"logs in {work_dir}")
+    shutil.rmtree(template, ignore_errors=True)
+    sys.exit(0 if same and all(run["status"] == "done" for run in runs) else 1)
+
+
+if __name__ == "__main__":
+    main()
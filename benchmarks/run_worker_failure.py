@@ -0,0 +1,75 @@
+"""Runs two tests in a row in one worker, the first one failing once its report is sent.
+
+    python benchmarks/run_worker_failure.py [--scenario small]
+
+The worker runs in this process so the failure can be injected. The second run must report its progress, send
+the same report and leave no uploads or control calls behind, like a run of a fresh worker.
+"""
+import argparse
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from galloper_stub import GalloperStub  # noqa: E402
+from run_benchmarks import REPO, SCENARIOS, THRESHOLDS, processing_env  # noqa: E402
+from run_shards import report_of  # noqa: E402
+from synthetic_results import SCRIPT_DIR, generate  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", default="small", help=f"any of {', '.join(SCENARIOS)}")
+    args = parser.parse_args()
+
+    params = SCENARIOS[args.scenario]
+    work_dir = tempfile.mkdtemp(prefix="results-worker-failure-")
+    root = os.path.join(work_dir, "sitespeed-result")
+    template = os.path.join(work_dir, "template")
+    generate(template, **params)
+    # stands in for sitespeed.io, the options of the run are ignored
+    copy_tree = f"sh -c {shlex.quote(f'rm -rf {root} && cp -r {template} {root}')} sitespeed"
+    stub = GalloperStub(thresholds=THRESHOLDS).start()
+    try:
+        # the modules read their configuration when they are imported
+        os.environ.update(processing_env(stub, root, work_dir, STATIC_REFRESH="false", SITESPEED_CMD=copy_tree))
+        os.chdir(work_dir)
+        sys.path.insert(0, REPO)
+        import results_processing
+        import worker_service
+        from util import control_plane, create_page_pool, uploader
+
+        finalize_report = results_processing.finalize_report
+
+        def failing_finalize_report(*args, **kwargs):
+            # only the first run fails
+            results_processing.finalize_report = finalize_report
+            finalize_report(*args, **kwargs)
+            raise RuntimeError("injected failure after the report was sent")
+
+        results_processing.finalize_report = failing_finalize_report
+        worker = worker_service.Worker(create_page_pool())
+        descriptor = {"test_id": "1", "script": SCRIPT_DIR.replace("_", "."), "loops": params["loops"],
+                      "aggregation": "max"}
+        worker.run_test(**descriptor)
+        # the failed run still waits for the report it sent
+        failed_report = report_of(stub) if stub.reports else None
+        stub.reset()
+        worker.run_test(**descriptor)
+        statuses = stub.stats()["by_endpoint"].get("report_status", 0)
+        same = report_of(stub) == failed_report
+        left = len(uploader.futures) + len([future for future in control_plane.futures if not future.done()])
+    finally:
+        stub.stop()
+
+    print(f"second run: {statuses} status updates, report {'identical' if same else 'DIFFERS'}, "
+          f"{left} uploads or control calls left, {uploader.stats()['failed']} failed uploads, logs in {work_dir}")
+    shutil.rmtree(template, ignore_errors=True)
+    sys.exit(0 if statuses and same and not left and not uploader.stats()["failed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Generates a synthetic sitespeed.io result tree shaped like the one results_processing.py reads.
+
+    python benchmarks/synthetic_results.py --pages 20 --loops 3 --frames 40 --html-kb 300 --json-kb 800
+
+The tree goes to $SITESPEED_RESULTS/<script_dir>/<run>/ (--root overrides it). The content is random
+but seeded, so the same arguments always produce the same tree.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import time
+
+SCRIPT_DIR = "script_js"
+RUN_DIR = "2026-10-18-10-00-00"
+REPORT_FILES = ["index.html", "detailed.html", "pages.html", "domains.html", "toplist.html", "assets.html",
+                "settings.html", "help.html"]
+STATIC_FILES = ["css/index.min.css", "img/ico/sitespeed.io-144.png", "img/ico/sitespeed.io-114.png",
+                "img/ico/sitespeed.io-72.png", "img/ico/sitespeed.io.ico", "img/sitespeed.io-logo.png", "img/coach.png",
+                "js/perf-cascade.min.js", "js/sortable.min.js", "js/chartist.min.js",
+                "js/chartist-plugin-axistitle.min.js", "js/chartist-plugin-tooltip.min.js",
+                "js/chartist-plugin-legend.min.js", "js/video.core.novtt.min.js", "font/glyphs.woff2"]
+
+
+def random_bytes(size):
+    return random.getrandbits(size * 8).to_bytes(size, "little")
+
+
+def html_page(prefix, body, size):
+    head = (f'<html><head><link href="{prefix}css/index.min.css" rel="stylesheet">'
+            f'<link href="{prefix}img/ico/sitespeed.io-144.png" rel="icon">'
+            f'<script src="{prefix}js/perf-cascade.min.js"></script><script src="{prefix}js/sortable.min.js"></script>'
+            f'</head><body><img src="{prefix}img/sitespeed.io-logo.png"><ul>'
+            + "".join(f'<li><a href="{prefix}{name}">{name}</a></li>' for name in REPORT_FILES
+                      if name not in ("assets.html", "help.html"))
+            + f'<li><a href="{prefix}assets.html">Assets</a></li><li><a href="{prefix}help.html#top">Help</a></li></ul>')
+    html = head + body
+    row = '<tr><td class="number">{}</td><td>{}</td><td>https://www.example.com/static/asset-{}.js</td></tr>\n'
+    rows = []
+    length = len(html)
+    while length < size:
+        rows.append(row.format(len(rows), random.randint(100, 90000), len(rows)))
+        length += len(rows[-1])
+    return html + "<table>" + "".join(rows) + "</table></body></html>"
+
+
+def page_summary(loops, size, rnd):
+    summary = {
+        "info": {"url": "https://www.example.com/", "browser": {"name": "chrome", "version": "120"}},
+        "timestamps": [f"2026-10-18T10:00:{i:02d}.000Z" for i in range(loops)],
+        "fullyLoaded": [rnd() for _ in range(loops)],
+        "visualMetrics": [{"SpeedIndex": rnd(), "FirstVisualChange": rnd(), "LastVisualChange": rnd(),
+                           "VisualProgress": {str(t): t // 100 for t in range(0, 3000, 100)}}
+                          for _ in range(loops)],
+        "browserScripts": [{"timings": {"ttfb": rnd(), "firstPaint": rnd() + 0.5,
+                                        "navigationTiming": {"domContentLoadedEventEnd": rnd(),
+                                                             "domComplete": rnd()}},
+                            "pageinfo": {"resources": []}} for _ in range(loops)],
+        "googleWebVitals": [{"firstContentfulPaint": rnd(), "largestContentfulPaint": rnd(),
+                             "cumulativeLayoutShift": random.random(), "totalBlockingTime": rnd()}
+                            for _ in range(loops)],
+    }
+    # the bulk of a real page summary is resource timings nobody reads
+    resources = summary["browserScripts"][0]["pageinfo"]["resources"]
+    length = len(json.dumps(summary))
+    while length < size:
+        resources.append({"name": f"https://www.example.com/static/{random.getrandbits(64):x}.js",
+                          "duration": random.random() * 1000, "transferSize": random.randint(100, 90000)})
+        length += len(json.dumps(resources[-1])) + 2
+    return summary
+
+
+def generate(root=None, pages=10, loops=3, frames=30, html_kb=200, json_kb=500, video_kb=400, seed=1):
+    """Write the tree and return the path of the run directory."""
+    root = root or os.environ.get("SITESPEED_RESULTS", "/sitespeed.io/sitespeed-result")
+    random.seed(seed)
+    shutil.rmtree(os.path.join(root, SCRIPT_DIR), ignore_errors=True)
+    run = os.path.join(root, SCRIPT_DIR, RUN_DIR) + "/"
+    os.makedirs(run)
+
+    def rnd():
+        return random.randint(100, 5000)
+
+    page_links = "".join(f'<a href="pages/www_example_com/page_{n}/index.html">page {n}</a>' for n in range(pages))
+    for name in REPORT_FILES:
+        with open(run + name, "w") as f:
+            f.write(html_page("", page_links, html_kb * 1024))
+    for name in STATIC_FILES:
+        os.makedirs(os.path.dirname(run + name), exist_ok=True)
+        with open(run + name, "wb") as f:
+            f.write(random_bytes(random.randint(2, 60) * 1024))
+
+    started = time.time() - pages
+    for n in range(pages):
+        path = f"{run}pages/www_example_com/page_{n}/"
+        os.makedirs(path + "data/video")
+        loop_links = "".join(
+            f'<a href="./{i}.html">run {i}</a><img src="data/screenshots/{i}/afterPageCompleteCheck.png">'
+            f'<video src="data/video/{i}.mp4"></video>'
+            + "".join(f'<img src="data/filmstrip/{i}/ms_{k * 100:06d}.jpg">' for k in range(frames))
+            for i in range(1, loops + 1))
+        for name in ["index.html", "metrics.html"] + [f"{i}.html" for i in range(1, loops + 1)]:
+            with open(path + name, "w") as f:
+                f.write(html_page("../../../", loop_links + '<a href="metrics.html">metrics</a>', html_kb * 1024))
+        for i in range(1, loops + 1):
+            os.makedirs(f"{path}data/filmstrip/{i}")
+            os.makedirs(f"{path}data/screenshots/{i}")
+            frame = random_bytes(random.randint(8, 30) * 1024)
+            for k in range(frames):
+                # the page stops changing after a while, like a real filmstrip
+                if k < frames // 2 or random.random() < 0.1:
+                    frame = random_bytes(random.randint(8, 30) * 1024)
+                with open(f"{path}data/filmstrip/{i}/ms_{k * 100:06d}.jpg", "wb") as f:
+                    f.write(frame)
+            with open(f"{path}data/screenshots/{i}/afterPageCompleteCheck.png", "wb") as f:
+                f.write(random_bytes(random.randint(50, 200) * 1024))
+            with open(f"{path}data/video/{i}.mp4", "wb") as f:
+                f.write(random_bytes(video_kb * 1024))
+        with open(f"{path}data/browsertime.pageSummary.json", "w") as f:
+            json.dump(page_summary(loops, json_kb * 1024, rnd), f)
+        # pages are processed in the order sitespeed.io finished them
+        os.utime(path, (started + n, started + n))
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", default=None, help="results root, $SITESPEED_RESULTS by default")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--loops", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=30, help="filmstrip frames per loop")
+    parser.add_argument("--html-kb", type=int, default=200, help="size of every html file")
+    parser.add_argument("--json-kb", type=int, default=500, help="size of every browsertime.pageSummary.json")
+    parser.add_argument("--video-kb", type=int, default=400, help="size of every video")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(generate(args.root, args.pages, args.loops, args.frames, args.html_kb, args.json_kb, args.video_kb,
+                   args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import Future, wait
+from contextlib import nullcontext
+from threading import Condition, Thread
+from traceback import format_exc
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# seconds to wait for the Galloper API to answer a control call
+CONTROL_TIMEOUT = float(os.environ.get("CONTROL_TIMEOUT", 30))
+# report_status gets at most one progress update per this many seconds, the latest progress wins
+STATUS_INTERVAL = float(os.environ.get("STATUS_INTERVAL", 5))
+# how long the end of the processing waits for control calls still in flight, e.g. notifications
+CONTROL_EXIT_WAIT = float(os.environ.get("CONTROL_EXIT_WAIT", 30))
+
+
+class ControlPlane(object):
+    """Sends Galloper API calls (thresholds, report status, notifications) from background threads over one
+    pooled session, so the processing does not wait for them.
+
+    ``request`` returns a Future. The threads are daemons, so a call still in flight when ``close`` stops
+    waiting does not keep the process alive.
+    """
+
+    def __init__(self, timeout=CONTROL_TIMEOUT, status_interval=STATUS_INTERVAL, timings=None):
+        self.timeout = timeout
+        self.status_interval = status_interval
+        self.timings = timings
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.futures = []
+        self.condition = Condition()
+        # (url, data, headers) of the latest progress not sent yet
+        self.status = None
+        self.status_thread = None
+        self.status_closed = False
+
+    def request(self, method, url, parse=None, after=None, phase=None, **kwargs):
+        """Send a request in the background, once the future ``after`` is done when it is given.
+
+        The future resolves to ``parse(response)``, or to the response itself. The response is None when the
+        request failed. A ``timeout`` keyword replaces the one of the control plane for this request.
+        """
+        future = Future()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            if after is not None:
+                wait([after])
+            try:
+                with self.timings.phase(phase) if self.timings and phase else nullcontext():
+                    resp = self._send(method, url, **kwargs)
+                future.set_result(parse(resp) if parse else resp)
+            except Exception as e:
+                print(format_exc())
+                future.set_exception(e)
+
+        with self.condition:
+            self.futures.append(future)
+        Thread(target=run, daemon=True).start()
+        return future
+
+    def get_json(self, url, default=None, **kwargs):
+        """Future of the JSON answer of a GET, ``default`` when the request fails or is not a 200."""
+        def parse(resp):
+            if resp is None or resp.status_code != 200:
+                return default
+            try:
+                return resp.json()
+            except ValueError:
+                return default
+        return self.request("GET", url, parse=parse, **kwargs)
+
+    def _send(self, method, url, timeout=None, **kwargs):
+        try:
+            return self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException:
+            print(format_exc())
+            return None
+
+    def report_status(self, url, status, headers=None):
+        """Queue a report_status update; updates closer than ``status_interval`` are coalesced, the latest wins."""
+        with self.condition:
+            if self.status_closed:
+                return
+            self.status = (url, {"test_status": status}, headers)
+            if self.status_thread is None:
+                self.status_thread = Thread(target=self._send_statuses, daemon=True)
+                self.status_thread.start()
+            self.condition.notify_all()
+
+    def _send_statuses(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.status is not None or self.status_closed)
+                if self.status is None:
+                    return
+                (url, data, headers), self.status = self.status, None
+            resp = self._send("PUT", url, json=data, headers=headers)
+            if resp is not None:
+                try:
+                    print(resp.json()["message"])
+                except Exception:
+                    print(resp.text)
+            with self.condition:
+                self.condition.wait_for(lambda: self.status_closed, timeout=self.status_interval)
+
+    def flush_status(self, timeout=CONTROL_EXIT_WAIT):
+        """Send the queued update now and take no more, so no progress lands after the final status."""
+        with self.condition:
+            self.status_closed = True
+            self.condition.notify_all()
+            thread = self.status_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def close(self, timeout=CONTROL_EXIT_WAIT):
+        """Wait for the calls in flight, then take status updates again so a worker process can reuse the pool."""
+        self.flush_status(timeout)
+        with self.condition:
+            futures = list(self.futures)
+        _, pending = wait(futures, timeout)
+        if pending:
+            print(f"{len(pending)} control requests still running, not waiting for them")
+        with self.condition:
+            self.futures = [future for future in self.futures if not future.done()]
+            self.status = None
+            self.status_thread = None
+            self.status_closed = False
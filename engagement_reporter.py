@@ -1,11 +1,21 @@
-from requests import post, get
+import os
+from concurrent.futures import ThreadPoolExecutor
 from json import dumps
+from traceback import format_exc
 from typing import Dict, List
 import hashlib
 
+import requests
+from requests.adapters import HTTPAdapter
+
+# concurrent issue lookups, the issues themselves are created one after the other
+ENGAGEMENT_WORKERS = int(os.environ.get("ENGAGEMENT_WORKERS", 8))
+# seconds to wait for the issues API to answer a lookup or a creation
+ENGAGEMENT_TIMEOUT = float(os.environ.get("ENGAGEMENT_TIMEOUT", 30))
+
 
 class IssuesConnector(object):
-    def __init__(self, report_url, query_url, token):
+    def __init__(self, report_url, query_url, token, workers=ENGAGEMENT_WORKERS, timeout=ENGAGEMENT_TIMEOUT):
         self.report_url = report_url
         self.query_url = query_url
         self.token = token
@@ -13,31 +23,83 @@ class IssuesConnector(object):
             "Content-type": "application/json",
             "Authorization": f"Bearer {token}",
         }
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # hashes with an open issue, found by a lookup or created during this run
+        self.open_issues = set()
 
     def create_issue(self, payload):
-        issue_hash = payload['issue_id']
-        exists = self.search_for_issue(issue_hash)
-        if exists:
-            print(f"The issue with {payload['title']} title already exists")
-            return
-        
-        if exists is None:
-            print(f"Unable to connect to query url")
-            return
-
-        result = post(self.report_url, data=dumps(payload), headers=self.headers)
-        return result.content
-    
+        return self.create_issues([payload])[0]
+
+    def create_issues(self, payloads):
+        """Create the issues of ``payloads`` that are not open yet, every issue hash at most once.
+
+        Lookups run concurrently, the new issues are created one after the other in the order of ``payloads``.
+        The result is the response content of every payload in that order, None where no issue was created.
+        """
+        results = [None] * len(payloads)
+        # issue hash -> index of its first payload
+        pending = {}
+        for n, payload in enumerate(payloads):
+            issue_hash = payload['issue_id']
+            if issue_hash in self.open_issues or issue_hash in pending:
+                print(f"The issue with {payload['title']} title already exists")
+                continue
+            pending[issue_hash] = n
+        if not pending:
+            return results
+        new = []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as executor:
+            for (issue_hash, n), exists in zip(pending.items(), executor.map(self.search_for_issue, pending)):
+                if exists is None:
+                    print(f"Unable to connect to query url")
+                elif exists:
+                    print(f"The issue with {payloads[n]['title']} title already exists")
+                    self.open_issues.add(issue_hash)
+                else:
+                    new.append(n)
+        for n in new:
+            resp = self.post_issue(payloads[n])
+            if resp is None:
+                continue
+            results[n] = resp.content
+            if 200 <= resp.status_code < 300:
+                self.open_issues.add(payloads[n]['issue_id'])
+            else:
+                # a later lookup finds no open issue and creates it again
+                print(f"The issue with {payloads[n]['title']} title was not created: {resp.status_code}")
+        return results
+
+    def post_issue(self, payload):
+        """The response of the issue creation, None when the request failed."""
+        try:
+            return self.session.post(self.report_url, data=dumps(payload), headers=self.headers,
+                                     timeout=self.timeout)
+        except requests.RequestException:
+            print(format_exc())
+            return None
+
     def search_for_issue(self, issue_hash):
-        resp = get(self.query_url, params={'source.id': issue_hash, 'status': 'Open'}, headers=self.headers)
-        
-        if not resp.status_code == 200:
+        try:
+            resp = self.session.get(self.query_url, params={'source.id': issue_hash, 'status': 'Open'},
+                                    headers=self.headers, timeout=self.timeout)
+        except requests.RequestException:
+            print(format_exc())
+            return None
+
+        if not 200 <= resp.status_code < 300:
+            return None
+
+        # an answer that can't be read leaves the issue unknown, like a failed lookup
+        try:
+            return resp.json()['total'] != 0
+        except (ValueError, KeyError, TypeError):
+            print(f"Unexpected answer of the query url: {resp.text[:200]}")
             return None
-        
-        data = resp.json()
-        if not data['total'] == 0:
-            return True
-        return False
 
 
 class EngagementReporter:
@@ -62,14 +124,14 @@ class EngagementReporter:
 
     def report_findings(self, failed_thresholds):
         title = self.get_title()
-        hash_code = self.get_hash_code(title)
         description = self.create_description(failed_thresholds)
-        payload = self._prepare_issue_payload(
-            title, 
-            description, 
-            hash_code,
-        )
-        self.issues_connector.create_issue(payload)
+        self.report_issues([(title, description)])
+
+    def report_issues(self, issues):
+        """Create an issue for every ``(title, description)`` not reported yet, in bulk."""
+        payloads = [self._prepare_issue_payload(title, description, self.get_hash_code(title))
+                    for title, description in issues]
+        return self.issues_connector.create_issues(payloads)
     
     def get_hash_code(self, title):
         return hashlib.sha256(title.strip().encode('utf-8')).hexdigest()
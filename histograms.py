@@ -0,0 +1,83 @@
+import math
+import os
+
+# significant decimal digits a histogram keeps of every sample, 3 puts percentiles within 0.5% of the samples
+HISTOGRAM_DIGITS = int(os.environ.get("HISTOGRAM_DIGITS", 3))
+
+
+def round_significant(value, digits):
+    if not value:
+        return value
+    return round(value, digits - 1 - math.floor(math.log10(abs(value))))
+
+
+class Histogram(object):
+    """Sample counts by value rounded to ``digits`` significant digits, like an HDR histogram.
+
+    Count, sum, min and max are exact, percentiles are the rounded value of their rank (clamped to min and max).
+    The size is bounded by the range of the values, not their number, and histograms of the same precision merge
+    by adding their counts.
+    """
+
+    def __init__(self, digits=HISTOGRAM_DIGITS):
+        self.digits = digits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        if not math.isfinite(value):
+            return
+        key = round_significant(value, self.digits)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def record_all(self, values):
+        for value in values:
+            self.record(value)
+
+    def merge(self, other):
+        if other.digits != self.digits:
+            raise ValueError(f"Can't merge a histogram of {other.digits} digits into one of {self.digits}")
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def summary(self, percentiles):
+        """min, max, avg and ``percentiles`` (name -> percentile), ranked like ``util.summarize``."""
+        if not self.count:
+            return {}
+        summary = {"min": self.min, "max": self.max, "avg": int(self.total / self.count)}
+        ranks = sorted((int(math.ceil((self.count * pct) / 100)), name) for name, pct in percentiles.items())
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            while ranks and seen >= ranks[0][0]:
+                summary[ranks.pop(0)[1]] = min(max(key, self.min), self.max)
+        return summary
+
+    def state(self):
+        return {"digits": self.digits, "count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "counts": sorted(self.counts.items())}
+
+    @classmethod
+    def from_state(cls, state):
+        histogram = cls(state["digits"])
+        histogram.counts = {key: count for key, count in state["counts"]}
+        histogram.count = state["count"]
+        histogram.total = state["total"]
+        histogram.min = state["min"]
+        histogram.max = state["max"]
+        return histogram
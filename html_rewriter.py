@@ -0,0 +1,78 @@
+import re
+
+PAGE_LINK = re.compile('href="pages/(.+?)/index.html"')
+
+
+class LinkRewriter(object):
+    """Applies an ordered table of literal replacements to a document in a single regex pass.
+
+    ``replacements`` is the list of ``(old, new)`` pairs in the order they used to be applied with
+    ``str.replace``. When the table is built so that chained replacements could interact (one key
+    overlapping another, or a replacement producing a key) the rewriter falls back to applying it
+    sequentially, so the output is always the same as the chained ``str.replace`` calls. A key that
+    starts with a shorter key is fine when it comes first, the longest match wins in the single pass too.
+    ``page_link`` maps the path captured by ``PAGE_LINK`` to its replacement, it runs after the table.
+    """
+
+    def __init__(self, replacements, page_link=None):
+        self.replacements = []
+        self.table = {}
+        for old, new in replacements:
+            if old not in self.table:
+                self.table[old] = new
+                self.replacements.append((old, new))
+        self.page_link = page_link
+        self.single_pass = is_single_pass_safe(self.table)
+        keys = sorted(self.table, key=len, reverse=True)
+        self.pattern = re.compile("|".join(re.escape(k) for k in keys)) if keys else None
+
+    def rewrite(self, html):
+        if self.pattern is not None:
+            if self.single_pass:
+                html = self.pattern.sub(lambda m: self.table[m.group(0)], html)
+            else:
+                for old, new in self.replacements:
+                    html = html.replace(old, new)
+        if self.page_link is not None:
+            html = self.rewrite_page_links(html)
+        return html
+
+    def rewrite_page_links(self, html):
+        links = PAGE_LINK.findall(html)
+        if not links:
+            return html
+        if any('"' in each for each in links):
+            # a lazy match ran across attributes, only the sequential replace gives the legacy result
+            for each in links:
+                new = self.page_link(each)
+                if new is not None:
+                    html = html.replace(f'href="pages/{each}/index.html"', new)
+            return html
+
+        def replace(match):
+            new = self.page_link(match.group(1))
+            return match.group(0) if new is None else new
+        return PAGE_LINK.sub(replace, html)
+
+
+def is_single_pass_safe(table):
+    keys = list(table)
+    order = {key: n for n, key in enumerate(keys)}
+    prefixes = {key[:i] for key in keys for i in range(1, len(key))}
+    suffixes = {key[i:] for key in keys for i in range(1, len(key))}
+    longest = max((len(key) for key in keys), default=0)
+    for key in keys:
+        for other in keys:
+            if other != key and other in key and not (key.startswith(other) and order[key] < order[other] and
+                                                      key.find(other, 1) == -1):
+                return False
+        # a suffix of one key is a prefix of another, so their occurrences can overlap
+        if any(key[-i:] in prefixes for i in range(1, len(key))):
+            return False
+    for new in table.values():
+        if any(key in new or new in key for key in keys):
+            return False
+        # the replacement could form a key together with the text around it
+        if any(new[-i:] in prefixes or new[:i] in suffixes for i in range(1, min(len(new), longest) + 1)):
+            return False
+    return True
@@ -1,5 +1,10 @@
 #!/bin/bash
 
+if [[ "$1" == "worker" ]]; then
+    # a long-lived worker takes runs over HTTP, see worker_service.py
+    exec python3 /worker_service.py
+fi
+
 args=$@
 export reports=""
 IFS=" " read -ra PARAMS <<< "$args"
@@ -26,6 +31,36 @@ python3 /minio_tests_reader.py
 echo "Scripts downloaded"
 ls
 echo "Start test"
+if [[ "${SHARDS:-1}" -gt 1 && "$script_name" != *.js ]]; then
+    # the url list is split across local workers, each tests and processes its part, the merge reports the run
+    export SHARDS_DIR=${SHARDS_DIR:-/tmp/shards/}
+    shards=$(python3 /shards.py split /$script_name $SHARDS $SHARDS_DIR)
+    script_dir=${script_name##*/}
+    for ((shard = 0; shard < shards; shard++)); do
+        (
+            export SHARD_INDEX=$shard RESULTS_WATCH=false SITESPEED_RESULTS=${SHARDS_DIR}${shard}/sitespeed-result
+            /bin/bash /start.sh ${SHARDS_DIR}${shard}/${script_dir} --multi -n $loops --plugins.add analysisstorer \
+                --outputFolder ${SITESPEED_RESULTS}/${script_dir//./_}/$(date +%Y-%m-%d-%H-%M-%S) $custom_cmd
+            python3 /results_processing.py $test_id $script_name $loops $aggregation $reports
+        ) > ${SHARDS_DIR}${shard}/shard.log 2>&1 &
+    done
+    wait
+    echo "Test is done. Merging $shards shards..."
+    cat ${SHARDS_DIR}*/shard.log
+    RESULTS_MERGE=true python3 /results_processing.py $test_id $script_name $loops $aggregation $reports
+    exit 0
+fi
+if [[ "${RESULTS_WATCH}" == "true" ]]; then
+    export RESULTS_WATCH_DONE=${RESULTS_WATCH_DONE:-/tmp/sitespeed_done}
+    rm -f $RESULTS_WATCH_DONE
+    python3 /results_processing.py $test_id $script_name $loops $aggregation $reports &
+    processing_pid=$!
+fi
 /bin/bash /start.sh /$script_name --multi -n $loops --plugins.add analysisstorer $custom_cmd
 echo "Test is done. Results processing..."
-python3 /results_processing.py $test_id $script_name $loops $aggregation $reports
+if [[ "${RESULTS_WATCH}" == "true" ]]; then
+    touch $RESULTS_WATCH_DONE
+    wait $processing_pid
+else
+    python3 /results_processing.py $test_id $script_name $loops $aggregation $reports
+fi
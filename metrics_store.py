@@ -0,0 +1,185 @@
+import json
+import os
+from array import array
+from collections.abc import Mapping
+
+from histograms import Histogram, HISTOGRAM_DIGITS
+
+# the raw series of the run go into the report as JSON without spaces
+REPORT_COMPACT = os.environ.get("REPORT_COMPACT", "true").lower() == "true"
+# "histogram" keeps a histogram per metric instead of every sample of the run, see HistogramStore
+METRICS_SUMMARY = os.environ.get("METRICS_SUMMARY", "raw").lower()
+METRICS = ["load_time", "speed_index", "time_to_first_byte", "time_to_first_paint", "dom_content_loading",
+           "dom_processing", "first_contentful_paint", "largest_contentful_paint", "cumulative_layout_shift",
+           "total_blocking_time", "first_visual_change", "last_visual_change", "time_to_interactive"]
+# what a row reports for a metric the pages don't have, there is no TTI in browsertime json
+ROW_DEFAULTS = {"time_to_interactive": 0}
+PERCENTILES = {"pct50": 50, "pct75": 75, "pct90": 90, "pct95": 95, "pct99": 99}
+# what the report results of a histogram store list for every metric, in this order
+SUMMARY_RESULTS = ["min"] + list(PERCENTILES) + ["max"]
+
+
+def number(value):
+    """Columns hold doubles, integral values come back as ints like they came in."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def create_metrics_store():
+    return HistogramStore() if METRICS_SUMMARY == "histogram" else MetricsStore()
+
+
+def column_values(column):
+    """The column as a list, integral values as ints like they came in."""
+    return list(map(number, column))
+
+
+class MetricsStore(object):
+    """Metrics of every loop of every page, an ``array('d')`` column per metric instead of lists of objects.
+
+    A row is a loop, rows are in the order pages are added; ``pages`` keeps the (page name, first row, end row)
+    of every page. A metric the pages don't have keeps an empty column. Timestamps are not kept, a row view
+    gets the one of its loop from the page result.
+    """
+
+    def __init__(self, metrics=METRICS):
+        self.columns = {metric: array('d') for metric in metrics}
+        self.pages = []
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def extend(self, page_name, page_result):
+        """Add the loops of a page result, return the range of their rows.
+
+        Every metric of the page result must have a value per loop, a row is read across the columns.
+        """
+        start = self.rows
+        loops = len(page_result["load_time"])
+        for metric in self.columns:
+            if metric in page_result and len(page_result[metric]) != loops:
+                raise ValueError(f"{page_name} has {len(page_result[metric])} {metric} values for {loops} loops")
+        for metric, column in self.columns.items():
+            if metric in page_result:
+                column.extend(page_result[metric])
+        self.rows += loops
+        self.pages.append((page_name, start, self.rows))
+        return range(start, self.rows)
+
+    def state(self):
+        """The pages and columns as plain lists, to hand the store over to another process."""
+        return {"pages": self.pages, "columns": {metric: column_values(column)
+                                                 for metric, column in self.columns.items()}}
+
+    def merge(self, state):
+        """Append the rows of the ``state`` of another store, its page offsets moved behind the rows here."""
+        for page_name, start, end in state["pages"]:
+            self.pages.append((page_name, self.rows + start, self.rows + end))
+        for metric, column in self.columns.items():
+            column.extend(state["columns"].get(metric, ()))
+        if state["pages"]:
+            self.rows += state["pages"][-1][2]
+
+    def row(self, index, timestamp=None):
+        return MetricsRow(self.columns, index, timestamp)
+
+    def to_json(self, compact=REPORT_COMPACT):
+        """The columns as a JSON object of lists, the ``results`` of the report."""
+        separators = (",", ":") if compact else (", ", ": ")
+        return json.dumps({metric: column_values(column) for metric, column in self.columns.items()},
+                          separators=separators)
+
+
+class HistogramStore(object):
+    """Keeps a ``Histogram`` per metric for the run in place of its samples, so memory stays flat however long
+    the run gets; the summary of the run comes from the histograms.
+
+    Only the rows of the page added last can be viewed. Page summaries still come from the samples of the page.
+    """
+
+    def __init__(self, metrics=METRICS, digits=HISTOGRAM_DIGITS):
+        self.histograms = {metric: Histogram(digits) for metric in metrics}
+        self.pages = []
+        self.rows = 0
+        self.page_result = {}
+        self.page_start = 0
+
+    def __len__(self):
+        return self.rows
+
+    def extend(self, page_name, page_result):
+        """Add the loops of a page result, return the range of their rows."""
+        start = self.rows
+        for metric, histogram in self.histograms.items():
+            if metric in page_result:
+                histogram.record_all(page_result[metric])
+        self.rows += len(page_result["load_time"])
+        self.pages.append((page_name, start, self.rows))
+        self.page_result, self.page_start = page_result, start
+        return range(start, self.rows)
+
+    def summary(self, percentiles):
+        return {metric: histogram.summary(percentiles) for metric, histogram in self.histograms.items()}
+
+    def state(self):
+        return {"pages": self.pages,
+                "histograms": {metric: histogram.state() for metric, histogram in self.histograms.items()}}
+
+    def merge(self, state):
+        for page_name, start, end in state["pages"]:
+            self.pages.append((page_name, self.rows + start, self.rows + end))
+        for metric, histogram in self.histograms.items():
+            if metric in state["histograms"]:
+                histogram.merge(Histogram.from_state(state["histograms"][metric]))
+        if state["pages"]:
+            self.rows += state["pages"][-1][2]
+
+    def row(self, index, timestamp=None):
+        return MetricsRow(self.page_result, index - self.page_start, timestamp)
+
+    def to_json(self, compact=REPORT_COMPACT):
+        """The ``results`` of the report: a list per metric like the samples, of its SUMMARY_RESULTS values."""
+        separators = (",", ":") if compact else (", ", ": ")
+        summary = self.summary(PERCENTILES)
+        return json.dumps({metric: [number(summary[metric][name]) for name in SUMMARY_RESULTS]
+                           if summary[metric] else [] for metric in self.histograms}, separators=separators)
+
+    def histograms_json(self, compact=REPORT_COMPACT):
+        """The histograms as a JSON object, sent next to the ``results`` of the report."""
+        separators = (",", ":") if compact else (", ", ": ")
+        return json.dumps({metric: histogram.state() for metric, histogram in self.histograms.items()},
+                          separators=separators)
+
+
+class MetricsRow(Mapping):
+    """Read-only view of a row of ``columns`` (metric -> values), shaped like the per-loop dict of a page result
+    with its timestamp."""
+
+    __slots__ = ("columns", "index", "timestamp")
+
+    def __init__(self, columns, index, timestamp=None):
+        self.columns = columns
+        self.index = index
+        self.timestamp = timestamp
+
+    def __getitem__(self, metric):
+        if metric == "timestamps":
+            return self.timestamp
+        column = self.columns.get(metric, ())
+        if self.index < len(column):
+            return number(column[self.index])
+        return ROW_DEFAULTS[metric]
+
+    def __iter__(self):
+        yield "timestamps"
+        for metric, column in self.columns.items():
+            if metric != "timestamps" and self.index < len(column):
+                yield metric
+        for metric in ROW_DEFAULTS:
+            if len(self.columns.get(metric, ())) <= self.index:
+                yield metric
+
+    def __len__(self):
+        return sum(1 for _ in self)
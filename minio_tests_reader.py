@@ -1,8 +1,14 @@
 from os import environ
+import hashlib
+import json
+import os
 import requests
 import zipfile
 from json import loads
 from traceback import format_exc
+from requests.adapters import HTTPAdapter
+from control_plane import ControlPlane
+from timings import Timings, TESTS_READER_TIMINGS
 
 PROJECT_ID = environ.get('GALLOPER_PROJECT_ID')
 URL = environ.get('GALLOPER_URL')
@@ -12,31 +18,102 @@ TOKEN = environ.get("token")
 PATH_TO_FILE = f'/tmp/{TEST}'
 TESTS_PATH = environ.get("tests_path", '/')
 REPORT_ID = environ.get('REPORT_ID')
+# what was downloaded and extracted last time, mount it to share the cache between runs
+TESTS_CACHE_DIR = environ.get("TESTS_CACHE_DIR", "/tmp/tests_cache/")
+CHUNK_SIZE = 1024 * 1024
 
 integrations = loads(environ.get("integrations", '{}'))
 s3_config = integrations.get('system', {}).get('s3_integration', {})
+# a worker process downloads the bundle of every run over the same connections
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
 
-if not all(a for a in [URL, BUCKET, TEST]):
-    exit(0)
-
-try:
-    endpoint = f'/api/v1/artifacts/artifact/{PROJECT_ID}/{BUCKET}/{TEST}'
-    headers = {'Authorization': f'bearer {TOKEN}'} if TOKEN else {}
-    r = requests.get(f'{URL}/{endpoint}', params=s3_config, allow_redirects=True, headers=headers)
-    with open(PATH_TO_FILE, 'wb') as file_data:
-        file_data.write(r.content)
-    with zipfile.ZipFile(PATH_TO_FILE, 'r') as zip_ref:
-        zip_ref.extractall(TESTS_PATH)
-
-    headers = {'content-type': 'application/json', 'Authorization': f'bearer {TOKEN}'}
-    url = f'{URL}/api/v1/ui_performance/report_status/{PROJECT_ID}/{REPORT_ID}'
-    data = {"test_status": {"status": "In progress", "percentage": 10,
-                            "description": "Test started."}}
-    response = requests.put(url, json=data, headers=headers)
+
+def load_cache(cache_file):
     try:
-        print(response.json()["message"])
-    except:
-        print(response.text)
-except Exception:
-    print(format_exc())
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache_file, cache):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(f"{cache_file}.part", "w") as f:
+        json.dump(cache, f)
+    os.replace(f"{cache_file}.part", cache_file)
+
+
+def download_tests(url, headers, cache, path_to_file=PATH_TO_FILE):
+    """Stream the bundle to ``path_to_file`` unless the server says the copy there is current.
+
+    Return the sha256 and ETag of the bundle.
+    """
+    headers = dict(headers)
+    if cache.get("etag") and os.path.isfile(path_to_file):
+        headers['If-None-Match'] = cache["etag"]
+    with session.get(url, params=s3_config, allow_redirects=True, headers=headers, stream=True) as r:
+        if r.status_code == 304:
+            print("Tests bundle is not modified")
+            return cache["sha256"], cache["etag"]
+        r.raise_for_status()
+        sha = hashlib.sha256()
+        with open(f"{path_to_file}.part", 'wb') as file_data:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                sha.update(chunk)
+                file_data.write(chunk)
+        os.replace(f"{path_to_file}.part", path_to_file)
+        return sha.hexdigest(), r.headers.get("ETag")
+
+
+def extract_tests(extracted, path_to_file=PATH_TO_FILE):
+    """Extract the members that changed since ``extracted`` (name -> CRC) or whose file is gone.
+
+    Return the name -> CRC map of the bundle.
+    """
+    files = {}
+    skipped = 0
+    with zipfile.ZipFile(path_to_file, 'r') as zip_ref:
+        for member in zip_ref.infolist():
+            target = os.path.join(TESTS_PATH, member.filename)
+            if not member.is_dir() and extracted.get(member.filename) == member.CRC and \
+                    os.path.isfile(target) and os.path.getsize(target) == member.file_size:
+                skipped += 1
+            else:
+                zip_ref.extract(member, TESTS_PATH)
+            files[member.filename] = member.CRC
+    print(f"Tests: {len(files) - skipped} files extracted, {skipped} unchanged")
+    return files
+
+
+def read_tests(timings, control_plane, test=TEST, report_id=REPORT_ID):
+    """Download and extract the tests bundle, the status of the report is set to started meanwhile."""
+    path_to_file = f'/tmp/{test}'
+    try:
+        # the status goes out while the bundle is downloaded
+        control_plane.report_status(f'{URL}/api/v1/ui_performance/report_status/{PROJECT_ID}/{report_id}',
+                                    {"status": "In progress", "percentage": 10, "description": "Test started."},
+                                    headers={'content-type': 'application/json', 'Authorization': f'bearer {TOKEN}'})
+        endpoint = f'/api/v1/artifacts/artifact/{PROJECT_ID}/{BUCKET}/{test}'
+        headers = {'Authorization': f'bearer {TOKEN}'} if TOKEN else {}
+        cache_file = os.path.join(TESTS_CACHE_DIR, f"{BUCKET}_{test}.json")
+        cache = load_cache(cache_file)
+        with timings.phase("download_tests"):
+            sha, etag = download_tests(f'{URL}/{endpoint}', headers, cache, path_to_file)
+        with timings.phase("extract_tests"):
+            # files extracted somewhere else say nothing about what is in TESTS_PATH
+            files = extract_tests(cache.get("files", {}) if cache.get("tests_path") == TESTS_PATH else {}, path_to_file)
+        save_cache(cache_file, {"etag": etag, "sha256": sha, "tests_path": TESTS_PATH, "files": files})
+    except Exception:
+        print(format_exc())
+    finally:
+        control_plane.close()
+
 
+if __name__ == "__main__":
+    if not all(a for a in [URL, BUCKET, TEST]):
+        exit(0)
+    reader_timings = Timings()
+    read_tests(reader_timings, ControlPlane())
+    reader_timings.save(TESTS_READER_TIMINGS)
@@ -0,0 +1,154 @@
+import json
+import os
+import re
+from json.decoder import scanstring
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# json: stdlib decoder, one top-level member at a time (low memory, no dependencies)
+# orjson: whole document with orjson (fastest, whole-document memory), ijson: event stream (constant memory, slowest)
+# auto is json: about as fast as loading the whole document, with a fraction of its memory
+PAGE_SUMMARY_BACKEND = os.environ.get("PAGE_SUMMARY_BACKEND", "auto")
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+decoder = json.JSONDecoder()
+
+# paths in ijson prefix notation, "item" stands for every element of an array
+PAGE_SUMMARY_FIELDS = (
+    "timestamps.item",
+    "fullyLoaded.item",
+    "visualMetrics.item.SpeedIndex",
+    "visualMetrics.item.FirstVisualChange",
+    "visualMetrics.item.LastVisualChange",
+    "browserScripts.item.timings.ttfb",
+    "browserScripts.item.timings.firstPaint",
+    "browserScripts.item.timings.navigationTiming.domContentLoadedEventEnd",
+    "browserScripts.item.timings.navigationTiming.domComplete",
+    "googleWebVitals.item.firstContentfulPaint",
+    "googleWebVitals.item.largestContentfulPaint",
+    "googleWebVitals.item.cumulativeLayoutShift",
+    "googleWebVitals.item.totalBlockingTime",
+)
+
+
+def get_backend(backend=PAGE_SUMMARY_BACKEND):
+    if backend == "auto":
+        return "json"
+    return backend
+
+
+def read_page_summary(json_file, fields=PAGE_SUMMARY_FIELDS, backend=PAGE_SUMMARY_BACKEND):
+    """Load only the scalar ``fields`` of a JSON document, keeping their nesting."""
+    backend = get_backend(backend)
+    if backend == "ijson":
+        with open(json_file, "rb") as f:
+            return stream_fields(f, fields)
+    if backend == "orjson":
+        with open(json_file, "rb") as f:
+            return project(orjson.loads(f.read()), field_tree(fields))
+    with open(json_file, "r") as f:
+        return decode_fields(f.read(), fields)
+
+
+def field_tree(fields):
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = None
+    return tree
+
+
+def project(doc, tree):
+    if tree is None:
+        return doc
+    if "item" in tree:
+        return [project(each, tree["item"]) for each in doc]
+    return {key: project(doc[key], sub_tree) for key, sub_tree in tree.items() if key in doc}
+
+
+def decode_fields(text, fields):
+    """Decode a JSON object one top-level member (and one element of top-level arrays) at a time.
+
+    Members that are not requested are decoded and dropped right away, so at most one of them is alive at once.
+    """
+    tree = field_tree(fields)
+    result = {}
+    idx = skip_whitespace(text, 0)
+    if text[idx] != "{":
+        raise ValueError("page summary is not a JSON object")
+    idx = skip_whitespace(text, idx + 1)
+    while text[idx] != "}":
+        key, idx = scanstring(text, idx + 1)
+        idx = skip_whitespace(text, idx)
+        if text[idx] != ":":
+            raise ValueError(f"expected ':' at {idx}")
+        idx = skip_whitespace(text, idx + 1)
+        sub_tree = tree.get(key, False)
+        if sub_tree is False:
+            _, idx = decoder.raw_decode(text, idx)
+        elif sub_tree is not None and "item" in sub_tree and text[idx] == "[":
+            result[key], idx = decode_elements(text, idx, sub_tree["item"])
+        else:
+            value, idx = decoder.raw_decode(text, idx)
+            result[key] = project(value, sub_tree)
+        idx = skip_whitespace(text, idx)
+        if text[idx] == ",":
+            idx = skip_whitespace(text, idx + 1)
+    return result
+
+
+def decode_elements(text, idx, tree):
+    elements = []
+    idx = skip_whitespace(text, idx + 1)
+    while text[idx] != "]":
+        value, idx = decoder.raw_decode(text, idx)
+        elements.append(project(value, tree))
+        idx = skip_whitespace(text, idx)
+        if text[idx] == ",":
+            idx = skip_whitespace(text, idx + 1)
+    return elements, idx + 1
+
+
+def skip_whitespace(text, idx):
+    return WHITESPACE.match(text, idx).end()
+
+
+def stream_fields(f, fields):
+    leaves = set(fields)
+    # requested arrays are created on their start, so that empty ones are kept
+    arrays = {field[:i] for field in fields for i in range(len(field)) if field.startswith(".item", i)}
+    # every array element that holds a requested field gets its own container in the result
+    elements = {field[:i + len(".item")] for field in fields
+                for i in range(len(field)) if field.startswith(".item", i)}
+    result = {}
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if prefix in leaves:
+            if event not in ("start_map", "start_array", "end_map", "end_array", "map_key"):
+                set_path(result, prefix.split("."), value)
+        elif prefix in elements and event == "start_map":
+            set_path(result, prefix.split("."), {})
+        elif prefix in arrays and event == "start_array":
+            set_path(result, prefix.split("."), [])
+    return result
+
+
+def set_path(node, parts, value):
+    for i, part in enumerate(parts[:-1]):
+        if part == "item":
+            node = node[-1]
+        else:
+            node = node.setdefault(part, [] if parts[i + 1] == "item" else {})
+    if parts[-1] == "item":
+        node.append(value)
+    else:
+        node[parts[-1]] = value
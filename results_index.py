@@ -0,0 +1,213 @@
+import os
+import time
+from collections import namedtuple
+
+SITESPEED_RESULTS = os.environ.get("SITESPEED_RESULTS", "/sitespeed.io/sitespeed-result")
+RESULTS_WATCH = os.environ.get("RESULTS_WATCH", "false").lower() == "true"
+# created by launch.sh once sitespeed.io has finished
+RESULTS_WATCH_DONE = os.environ.get("RESULTS_WATCH_DONE", "/tmp/sitespeed_done")
+RESULTS_WATCH_INTERVAL = float(os.environ.get("RESULTS_WATCH_INTERVAL", 2))
+# a page summary younger than this may still be written
+RESULTS_WATCH_SETTLE = float(os.environ.get("RESULTS_WATCH_SETTLE", 2))
+# pages are prepared one at a time while sitespeed.io runs, so they take a single CPU from the browser;
+# "true" prepares them in the page pool meanwhile
+RESULTS_WATCH_PARALLEL = os.environ.get("RESULTS_WATCH_PARALLEL", "false").lower() == "true"
+STATIC_DIRS = ["css", "img", "img/ico", "js", "font"]
+
+PageEntry = namedtuple("PageEntry", ["page_name", "path", "prefix", "record_name", "last", "loops"])
+LoopEntry = namedtuple("LoopEntry", ["loop", "html", "filmstrip", "screenshots", "video"])
+
+
+class DirNode(object):
+    """A directory read with os.scandir: sub directories and files (with their cached stat) in listing order."""
+    __slots__ = ("path", "stat", "dirs", "files", "symlink")
+
+    def __init__(self, path, stat=None, symlink=False):
+        self.path = path
+        self.stat = stat
+        self.symlink = symlink
+        self.dirs = {}
+        self.files = {}
+
+    def get(self, rel_path):
+        node = self
+        for part in rel_path.strip("/").split("/"):
+            node = node.dirs.get(part)
+            if node is None:
+                return None
+        return node
+
+    def file_names(self, rel_path=""):
+        node = self.get(rel_path) if rel_path else self
+        return list(node.files) if node is not None else []
+
+
+def scan_tree(path, stat=None, symlink=False):
+    node = DirNode(path.rstrip("/") + "/", stat, symlink)
+    if symlink:
+        # os.walk lists symlinked directories but does not descend into them
+        return node
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                node.dirs[entry.name] = scan_tree(entry.path, entry.stat(), entry.is_symlink())
+            elif entry.is_file():
+                node.files[entry.name] = entry.stat()
+    return node
+
+
+class ResultsIndex(object):
+    """Everything the results processing needs from the sitespeed.io output, read in a single walk.
+
+    ``run_path`` is the report of ``script_dir`` (the first run found, as before), ``pages`` are its pages in
+    the order they finished, ``archive_entries`` is the whole results tree in shutil.make_archive order.
+    """
+
+    def __init__(self, script_dir, loops, results_root=SITESPEED_RESULTS):
+        self.root = scan_tree(results_root)
+        self.loops = loops
+        script = self.root.get(script_dir)
+        run = next(iter(script.dirs.values()))
+        self.run = run
+        self.run_path = run.path
+        self.static_files = {each: run.file_names(each) for each in STATIC_DIRS}
+        self.pages = index_pages(run.get("pages"), loops) if run.get("pages") else []
+
+    @property
+    def archive_entries(self):
+        """(path, stat) pairs, stat is None for directories."""
+        base = self.root.path.rstrip("/")
+        entries = [(base, None)]
+        walk_archive_entries(self.root, entries)
+        return entries
+
+
+def walk_archive_entries(node, entries):
+    dirpath = node.path.rstrip("/")
+    for name in sorted(node.dirs):
+        entries.append((os.path.join(dirpath, name), None))
+    for name, stat in node.files.items():
+        entries.append((os.path.join(dirpath, name), stat))
+    for sub_dir in node.dirs.values():
+        if not sub_dir.symlink:
+            walk_archive_entries(sub_dir, entries)
+
+
+def index_pages(pages_dir, loops):
+    candidates = []
+    for each in pages_dir.dirs.values():
+        for sub_dir in each.dirs.values():
+            if "index.html" in sub_dir.files:
+                candidates.append(sub_dir)
+            else:
+                candidates.extend(sub_dir.dirs.values())
+    # pages in the order sitespeed.io finished them
+    candidates.sort(key=lambda node: node.stat.st_mtime)
+    pages = []
+    for node in candidates:
+        name = node.path.split("/")[-2]
+        if "index.html" in node.files:
+            pages.append(index_page(node.path, name, "../../../", name, True, loops, node))
+        else:
+            sub_dirs = list(node.dirs.values())
+            for n, sub_dir in enumerate(sub_dirs):
+                pages.append(index_page(sub_dir.path, sub_dir.path.split("/")[-2], "../../../../", name,
+                                        n == len(sub_dirs) - 1, loops, sub_dir))
+    return pages
+
+
+def index_page(path, page_name, prefix, record_name, last, loops, node=None):
+    node = node or scan_tree(path)
+    page_loops = []
+    for i in range(1, loops + 1):
+        video = f"{i}.mp4" if f"{i}.mp4" in node.file_names("data/video") else None
+        page_loops.append(LoopEntry(i, f"{i}.html", node.file_names(f"data/filmstrip/{i}"),
+                                    node.file_names(f"data/screenshots/{i}"), video))
+    return PageEntry(page_name, node.path, prefix, record_name, last, page_loops)
+
+
+def list_dirs(path):
+    try:
+        with os.scandir(path) as entries:
+            return [entry for entry in entries if entry.is_dir()]
+    except FileNotFoundError:
+        return []
+
+
+class ResultsWatcher(object):
+    """Finds the pages of ``script_dir`` that are complete while sitespeed.io is still running.
+
+    A page is complete when its ``browsertime.pageSummary.json`` has settled and every loop has its
+    filmstrip, screenshots and video (for the kinds of artifacts the run produces). Pages are found
+    the way ``index_pages`` finds them, except that ``index.html`` does not exist before the run ends,
+    so a page directory is recognised by its ``data`` directory. Pages of a group are never ``last``
+    here, which one is last is only known once the group is complete.
+    """
+
+    def __init__(self, script_dir, loops, results_root=SITESPEED_RESULTS, done_file=RESULTS_WATCH_DONE,
+                 interval=RESULTS_WATCH_INTERVAL, settle=RESULTS_WATCH_SETTLE):
+        self.script_path = os.path.join(results_root, script_dir)
+        self.loops = loops
+        self.done_file = done_file
+        self.interval = interval
+        self.settle = settle
+        self.seen = set()
+
+    def finished(self):
+        return os.path.exists(self.done_file)
+
+    def batches(self):
+        """Yield lists of newly completed pages until sitespeed.io is done and the last scan found nothing."""
+        while True:
+            # checked before the scan, so a page completed before the marker appeared is never missed
+            finished = self.finished()
+            pages = self.poll(settle=0 if finished else self.settle)
+            if pages:
+                yield pages
+            if finished:
+                return
+            if not pages:
+                time.sleep(self.interval)
+
+    def poll(self, settle=0):
+        runs = list_dirs(self.script_path)
+        if not runs:
+            return []
+        pages = []
+        for domain in list_dirs(os.path.join(runs[0].path, "pages")):
+            for each in list_dirs(domain.path):
+                sub_dirs = list_dirs(each.path)
+                if any(sub_dir.name == "data" for sub_dir in sub_dirs):
+                    self.add_page(pages, each.path, each.name, "../../../", each.name, True, settle)
+                    continue
+                for node in sub_dirs:
+                    page_dirs = list_dirs(node.path)
+                    if any(page_dir.name == "data" for page_dir in page_dirs):
+                        self.add_page(pages, node.path, node.name, "../../../", node.name, True, settle)
+                        continue
+                    for page_dir in page_dirs:
+                        self.add_page(pages, page_dir.path, page_dir.name, "../../../../", node.name, False, settle)
+        return pages
+
+    def add_page(self, pages, path, page_name, prefix, record_name, last, settle):
+        path = path + "/"
+        if path in self.seen or not self.is_complete(path, settle):
+            return
+        self.seen.add(path)
+        pages.append(index_page(path, page_name, prefix, record_name, last, self.loops))
+
+    def is_complete(self, path, settle):
+        try:
+            summary = os.stat(f"{path}data/browsertime.pageSummary.json")
+        except FileNotFoundError:
+            return False
+        if time.time() - summary.st_mtime < settle:
+            return False
+        for kind in ("filmstrip", "screenshots"):
+            if os.path.isdir(f"{path}data/{kind}") and not all(
+                    os.path.isdir(f"{path}data/{kind}/{i}") for i in range(1, self.loops + 1)):
+                return False
+        if os.path.isdir(f"{path}data/video") and not all(
+                os.path.isfile(f"{path}data/video/{i}.mp4") for i in range(1, self.loops + 1)):
+            return False
+        return True
@@ -1,14 +1,23 @@
-from util import is_threshold_failed, get_aggregated_value, process_page_results, aggregate_results, get_record, \
-    finalize_report, upload_distributed_report_files, upload_distributed_report, upload_static_files, update_test_results
+from util import summarize_metrics, aggregate_results, get_record, finalize_report, upload_distributed_report_files, \
+    upload_distributed_report, upload_static_files, update_test_results, wait_for_uploads, upload_files, \
+    create_page_pool, prepare_pages, prepare_page_data_job, prepare_page_html_job, upload_timings, timings, \
+    control_plane, fetch_thresholds, report_progress, uploader
+from shards import SHARD_INDEX, RESULTS_MERGE, load_partials, merge_partials, save_partial
 
 import os
 from traceback import format_exc
-import requests
+from functools import lru_cache
 from json import loads
 from datetime import datetime
 import pytz
 import sys
 from engagement_reporter import EngagementReporter
+from metrics_store import create_metrics_store
+from results_index import ResultsIndex, ResultsWatcher, RESULTS_WATCH, RESULTS_WATCH_PARALLEL
+from results_writer import ResultsWriter, ResultsRows
+from thresholds import ThresholdEngine
+from uploader import PRIORITY_RESULTS
+from timings import TESTS_READER_TIMINGS
 
 
 PROJECT_ID = os.environ.get('GALLOPER_PROJECT_ID')
@@ -24,193 +33,197 @@ TEST_NAME = os.environ.get("JOB_NAME")
 ENV = os.environ.get("ENV")
 
 
-try:
-    # Get thresholds
-    res = None
-    try:
-        res = requests.get(
-            f"{URL}/api/v1/ui_performance/thresholds/{PROJECT_ID}?test={TEST_NAME}&env={ENV}&order=asc",
-            headers={'Authorization': f"Bearer {TOKEN}"})
-    except Exception:
-        print(format_exc())
-
-    if not res or res.status_code != 200:
-        thresholds = []
+def main(test_id, script, loops, aggregation, report_id=REPORT_ID, test_name=TEST_NAME, env=ENV, page_pool=None,
+         reader_timings=TESTS_READER_TIMINGS):
+    """Process and report the results of a run, ``page_pool`` is created and closed here unless one is given."""
+    if SHARD_INDEX is None and reader_timings:
+        timings.load(reader_timings)
 
     try:
-        thresholds = res.json()
-    except ValueError:
-        thresholds = []
-
-    records = []
-
-    failed_thresholds = []
-    all_thresholds: list = list(filter(lambda _th: _th['scope'] == 'all', thresholds))
-    every_thresholds: list = list(filter(lambda _th: _th['scope'] == 'every', thresholds))
-    page_thresholds: list = list(filter(lambda _th: _th['scope'] != 'every' and _th['scope'] != 'all', thresholds))
-    test_thresholds_total = 0
-    test_thresholds_failed = 0
-
-    format_str = "%d%b%Y_%H:%M:%S"
-    timestamp = datetime.now().strftime(format_str)
-    upload_distributed_report(timestamp, URL, PROJECT_ID, TOKEN)
-    script_path_split = sys.argv[2].split('/')[-1]
-    results_path = f"/sitespeed.io/sitespeed-result/{script_path_split.replace('.', '_')}/"
-    dir_name = os.listdir(results_path)
-    upload_static_files(f"{results_path}{dir_name[0]}/", URL, PROJECT_ID, TOKEN)
-    upload_distributed_report_files(f"{results_path}{dir_name[0]}/", timestamp, URL, PROJECT_ID, TOKEN, int(sys.argv[3]))
-    results_path = f"{results_path}{dir_name[0]}/pages/"
-    dir_names = os.listdir(results_path)
-    all_results = {"load_time": [], "speed_index": [], "time_to_first_byte": [], "time_to_first_paint": [],
-                   "dom_content_loading": [], "dom_processing": [], "first_contentful_paint": [],
-                   "largest_contentful_paint": [], "cumulative_layout_shift": [], "total_blocking_time": [],
-                   "first_visual_change": [], "last_visual_change": [], "time_to_interactive": []}
-    
-    sub_dir_names = []
-    for each in dir_names:
-        _sub_dirs = os.listdir(f"{results_path}{each}/")
-        for _ in _sub_dirs:
-            if "index.html" in os.listdir(f"{results_path}{each}/{_}"):
-                _sub_dirs = [os.path.join(f"{results_path}{each}/", f"{_}/")]
-            else:
-                _sub_dirs = [os.path.join(f"{results_path}{each}/{_}", f"{f}/") for f in os.listdir(f"{results_path}{each}/{_}")]
-            sub_dir_names.extend(_sub_dirs)
-
-    sub_dir_names.sort(key=lambda x: os.path.getmtime(x))
-    for sub_dir_path in sub_dir_names:
-        sub_dir = sub_dir_path.split("/")[-2]
-        if "index.html" in os.listdir(sub_dir_path):
-            page_result = process_page_results(sub_dir, sub_dir_path, URL, PROJECT_ID, TOKEN, timestamp,
-                                               prefix="../../../", loops=int(sys.argv[3]))
-            # Add page results to the summary dict
-            for metric in list(all_results.keys()):
-                try:
-                    all_results[metric].extend(page_result[metric])
-                except:
-                    ...
-            for i in range(len(page_result["load_time"])):
-                records.append(get_record(sub_dir, page_result, timestamp, i))
-            aggregated_result = aggregate_results(page_result)
-            records.append(get_record(sub_dir, aggregated_result, timestamp, -1))
-        else:
-            for sub_sub_dir in os.listdir(sub_dir_path):
-                page_result = process_page_results(sub_sub_dir, f"{sub_dir_path}{sub_sub_dir}/", URL, PROJECT_ID,
-                                                   TOKEN, timestamp, prefix="../../../../", loops=int(sys.argv[3]))
-                # Add page results to the summary dict
-                for metric in list(all_results.keys()):
-                    all_results[metric].extend(page_result[metric])
-                for i in range(len(page_result["load_time"])):
-                    records.append(get_record(sub_dir, page_result, timestamp, i))
-                aggregated_result = aggregate_results(page_result)
-                records.append(get_record(sub_dir, aggregated_result, timestamp, 0))
-
-
-        # Process thresholds with scope = every
-        for th in every_thresholds:
-            test_thresholds_total += 1
-            if not is_threshold_failed(aggregated_result.get(th["target"]), th["comparison"], th["value"]):
-                print(f"Threshold: {th['scope']} {th['target']} {th['aggregation']} value {aggregated_result.get(th['target'])}"
-                      f" comply with rule {th['comparison']} {th['value']} [PASSED]")
-            else:
-                test_thresholds_failed += 1
-                threshold = dict(**th)
-                threshold['actual_value'] = aggregated_result.get(th["target"])
-                threshold['page'] = sub_dir
-                failed_thresholds.append(threshold)
-                print(f"Threshold: {th['scope']} {th['target']} {th['aggregation']} value {aggregated_result.get(th['target'])}"
-                      f" violates rule {th['comparison']} {th['value']} [FAILED]")
-
-        # Process thresholds for current page
-        for th in page_thresholds:
-            if th["scope"] == f'{sub_dir}':
-                test_thresholds_total += 1
-                if not is_threshold_failed(aggregated_result.get(th["target"]), th["comparison"], th["value"]):
-                    print(
-                        f"Threshold: {th['scope']} {th['target']} {th['aggregation']} value {aggregated_result.get(th['target'])}"
-                        f" comply with rule {th['comparison']} {th['value']} [PASSED]")
-                else:
-                    test_thresholds_failed += 1
-                    threshold = dict(**th)
-                    threshold['actual_value'] = aggregated_result.get(th["target"])
-                    failed_thresholds.append(threshold)
-                    print(
-                        f"Threshold: {th['scope']} {th['target']} {th['aggregation']} value {aggregated_result.get(th['target'])}"
-                        f" violates rule {th['comparison']} {th['value']} [FAILED]")
-
-    update_test_results(TEST_NAME, URL, PROJECT_ID, TOKEN, REPORT_ID, records)
-
-    # Process thresholds with scope = all
-    for th in all_thresholds:
-        test_thresholds_total += 1
-        actual_value = get_aggregated_value(th["aggregation"], all_results.get(th["target"]))
-        if not is_threshold_failed(actual_value, th["comparison"], th["value"]):
-            print(f"Threshold: {th['scope']} {th['target']} {th['aggregation']} value {all_results.get(th['target'])}"
-                  f" comply with rule {th['comparison']} {th['value']} [PASSED]")
+        # the page workers are forked before any background thread is started
+        own_pool = page_pool is None and not RESULTS_MERGE
+        if own_pool:
+            page_pool = create_page_pool()
+        # thresholds are fetched while the results are indexed, they are first needed by the first page
+        thresholds_request = fetch_thresholds(URL, PROJECT_ID, TOKEN, test_name, env)
+
+        @lru_cache(maxsize=None)
+        def threshold_engine():
+            with timings.phase("wait_for_thresholds"):
+                return ThresholdEngine(thresholds_request.result())
+
+        results_writer = ResultsWriter(report_id) if SHARD_INDEX is None else ResultsRows()
+
+        format_str = "%d%b%Y_%H:%M:%S"
+        timestamp = datetime.now().strftime(format_str)
+        if SHARD_INDEX is not None:
+            # shards upload their pages and report files side by side
+            timestamp = f"{timestamp}_shard{SHARD_INDEX}"
+        script_dir = script.split('/')[-1].replace('.', '_')
+        metrics = create_metrics_store()
+
+        def page_done(done, total=None):
+            # shards would report conflicting progress, the merge step reports the run
+            if SHARD_INDEX is None:
+                report_progress(URL, PROJECT_ID, TOKEN, report_id, done, total)
+
+        def ingest_page(page, page_result, uploads):
+            upload_files(uploads, URL, PROJECT_ID, TOKEN)
+            # Add page results to the metrics of the run
+            for i, row in enumerate(metrics.extend(page.record_name, page_result)):
+                results_writer.append(get_record(page.record_name, metrics.row(row, page_result["timestamps"][i]),
+                                                 timestamp, i))
+            aggregated_result = aggregate_results(page_result, aggregation=aggregation)
+            results_writer.append(get_record(page.record_name, aggregated_result, timestamp, -1))
+
+            # Process thresholds with scope = every and for the current page
+            if page.last:
+                threshold_engine().evaluate_page(page.record_name, aggregated_result)
+            return aggregated_result
+
+        if RESULTS_MERGE:
+            merge_partials(load_partials(), metrics, results_writer, threshold_engine())
         else:
-            test_thresholds_failed += 1
-            threshold = dict(actual_value=actual_value, **th)
-            failed_thresholds.append(threshold)
-            print(f"Threshold: {th['scope']} {th['target']} {th['aggregation']} value {all_results.get(th['target'])}"
-                  f" violates rule {th['comparison']} {th['value']} [FAILED]")
+            # page path -> aggregated result of the pages ingested while sitespeed.io was running,
+            # None once their thresholds are evaluated
+            ingested = {}
+            if RESULTS_WATCH:
+                watcher = ResultsWatcher(script_dir, loops)
+                # sitespeed.io is still measuring, the processing keeps to one CPU and the upload bandwidth cap
+                watch_pool = page_pool if RESULTS_WATCH_PARALLEL else None
+                uploader.limit_results = True
+                try:
+                    with timings.phase("watch_results"):
+                        for batch in watcher.batches():
+                            for page, (page_result, uploads) in zip(batch, prepare_pages(
+                                    watch_pool, batch, URL, PROJECT_ID, timestamp, prepare_page_data_job)):
+                                aggregated_result = ingest_page(page, page_result, uploads)
+                                ingested[page.path] = None if page.last else aggregated_result
+                                page_done(len(ingested))
+                finally:
+                    uploader.limit_results = False
+                print(f"{len(ingested)} pages processed during the test")
+
+            with timings.phase("index_results"):
+                results_index = ResultsIndex(script_dir, loops)
+            upload_distributed_report(timestamp, URL, PROJECT_ID, TOKEN, entries=results_index.archive_entries)
+            upload_static_files(results_index.run_path, URL, PROJECT_ID, TOKEN, results_index.static_files)
+            upload_distributed_report_files(results_index.run_path, timestamp, URL, PROJECT_ID, TOKEN, loops)
+
+            # only the html (rendered when the run ends) is left of the pages ingested during the test
+            watched = [page for page in results_index.pages if page.path in ingested]
+            done = 0
+            for page, uploads in zip(watched, prepare_pages(page_pool, watched, URL, PROJECT_ID, timestamp,
+                                                            prepare_page_html_job)):
+                upload_files(uploads, URL, PROJECT_ID, TOKEN)
+                if page.last and ingested[page.path] is not None:
+                    threshold_engine().evaluate_page(page.record_name, ingested[page.path])
+                done += 1
+                page_done(done, len(results_index.pages))
+
+            # pages are prepared in parallel, but merged in the order of pages so the output matches a serial run
+            pages = [page for page in results_index.pages if page.path not in ingested]
+            for page, (page_result, uploads) in zip(pages, prepare_pages(page_pool, pages, URL, PROJECT_ID, timestamp)):
+                ingest_page(page, page_result, uploads)
+                done += 1
+                page_done(done, len(results_index.pages))
+            if own_pool and page_pool is not None:
+                page_pool.close()
+                page_pool.join()
+
+        if SHARD_INDEX is not None:
+            # the merge step reports the run, a shard only leaves its part of it
+            save_partial(SHARD_INDEX, timestamp, metrics, results_writer.rows, threshold_engine())
+            wait_for_uploads()
+            control_plane.close()
+            upload_timings(timestamp, URL, PROJECT_ID, TOKEN)
+            return
+
+        update_test_results(test_name, URL, PROJECT_ID, TOKEN, report_id, results_writer)
+
+        # Process thresholds with scope = all
+        thresholds = threshold_engine()
+        thresholds.evaluate_all(summarize_metrics(metrics) if thresholds.all_rules else {})
+
+        # the report is final once its results are uploaded, media and archives keep going meanwhile
+        wait_for_uploads(PRIORITY_RESULTS)
+        report_finalized = finalize_report(URL, PROJECT_ID, TOKEN, report_id, thresholds.total, thresholds.failed,
+                                           metrics)
+
+        # Email notification
+        try:
+            integrations = loads(os.environ.get("integrations"))
+        except:
+            integrations = None
+
+        if integrations and integrations.get("reporters") and "reporter_email" in integrations["reporters"].keys():
+            email_notification_id = integrations["reporters"]["reporter_email"].get("task_id")
+            if email_notification_id:
+                emails = integrations["reporters"]["reporter_email"].get("recipients", [])
+                if emails:
+                    task_url = f"{URL}/api/v1/tasks/run_task/{PROJECT_ID}/{email_notification_id}"
+
+                    event = {
+                        "notification_type": "ui",
+                        "smtp_host": integrations["reporters"]["reporter_email"]["integration_settings"]["host"],
+                        "smtp_port": integrations["reporters"]["reporter_email"]["integration_settings"]["port"],
+                        "smtp_user": integrations["reporters"]["reporter_email"]["integration_settings"]["user"],
+                        "smtp_sender": integrations["reporters"]["reporter_email"]["integration_settings"]["sender"],
+                        "smtp_password": integrations["reporters"]["reporter_email"]["integration_settings"]["passwd"],
+                        "user_list": emails,
+                        "test_id": test_id,
+                        "report_id": report_id
+                    }
+                    if integrations.get("processing") and "quality_gate" in integrations["processing"].keys():
+                        quality_gate_config = integrations['processing']['quality_gate']
+                    else:
+                        quality_gate_config = {}
+                    event["performance_degradation_rate"] = quality_gate_config.get('degradation_rate')
+                    event["missed_thresholds"] = quality_gate_config.get('missed_thresholds')
+
+                    # the task reads the finalized report, it is sent once the report is
+                    control_plane.request("POST", task_url,
+                                          parse=lambda res: print(res.text) if res is not None else None,
+                                          after=report_finalized, json=event,
+                                          headers={'Authorization': f'bearer {TOKEN}',
+                                                   'Content-type': 'application/json'})
+
+
+        engagement_reporter = None
+        if integrations and integrations.get("reporters") and "reporter_engagement" in integrations['reporters'].keys():
+            if URL and TOKEN and PROJECT_ID and thresholds.failed_thresholds:
+                payload = integrations['reporters']['reporter_engagement']
+                args = {
+                    'thresholds_failed': thresholds.failed,
+                    'thresholds_total': thresholds.total,
+                    'test_name': test_name,
+                    'env': env,
+                    'report_id': report_id,
+                }
+                reporter_url = URL + payload['report_url'] + '/' + PROJECT_ID
+                query_url = URL + payload['query_url'] + '/' + PROJECT_ID
+                reporter = EngagementReporter(
+                    reporter_url, query_url,
+                    TOKEN, payload['id'],
+                    args
+                )
+                reporter.report_findings(thresholds.failed_thresholds)
+
+        wait_for_uploads()
+        # the report is the result of the run, it is waited for however long it takes; close() only caps the
+        # best-effort status and notification calls
+        with timings.phase("wait_for_report"):
+            report_finalized.result()
+        control_plane.close()
+        upload_timings(timestamp, URL, PROJECT_ID, TOKEN)
+
+    except Exception:
+        print(format_exc())
+    finally:
+        # the next run of a worker process must not inherit the uploads and status updates of a failed run
+        wait_for_uploads()
+        control_plane.close()
 
-    finalize_report(URL, PROJECT_ID, TOKEN, REPORT_ID, test_thresholds_total, test_thresholds_failed, all_results)
 
-    # Email notification
-    try:
-        integrations = loads(os.environ.get("integrations"))
-    except:
-        integrations = None
-
-    if integrations and integrations.get("reporters") and "reporter_email" in integrations["reporters"].keys():
-        email_notification_id = integrations["reporters"]["reporter_email"].get("task_id")
-        if email_notification_id:
-            emails = integrations["reporters"]["reporter_email"].get("recipients", [])
-            if emails:
-                task_url = f"{URL}/api/v1/tasks/run_task/{PROJECT_ID}/{email_notification_id}"
-
-                event = {
-                    "notification_type": "ui",
-                    "smtp_host": integrations["reporters"]["reporter_email"]["integration_settings"]["host"],
-                    "smtp_port": integrations["reporters"]["reporter_email"]["integration_settings"]["port"],
-                    "smtp_user": integrations["reporters"]["reporter_email"]["integration_settings"]["user"],
-                    "smtp_sender": integrations["reporters"]["reporter_email"]["integration_settings"]["sender"],
-                    "smtp_password": integrations["reporters"]["reporter_email"]["integration_settings"]["passwd"],
-                    "user_list": emails,
-                    "test_id": sys.argv[1],
-                    "report_id": REPORT_ID
-                }
-                if integrations.get("processing") and "quality_gate" in integrations["processing"].keys():
-                    quality_gate_config = integrations['processing']['quality_gate']
-                else:
-                    quality_gate_config = {}
-                event["performance_degradation_rate"] = quality_gate_config.get('degradation_rate')
-                event["missed_thresholds"] = quality_gate_config.get('missed_thresholds')
-
-                res = requests.post(task_url, json=event, headers={'Authorization': f'bearer {TOKEN}',
-                                                                   'Content-type': 'application/json'})
-                print(res.text)
-
-
-    engagement_reporter = None
-    if integrations and integrations.get("reporters") and "reporter_engagement" in integrations['reporters'].keys():
-        if URL and TOKEN and PROJECT_ID and failed_thresholds:
-            payload = integrations['reporters']['reporter_engagement']
-            args = {
-                'thresholds_failed': test_thresholds_failed,
-                'thresholds_total': test_thresholds_total,
-                'test_name': TEST_NAME,
-                'env': ENV,
-                'report_id': REPORT_ID,
-            }
-            reporter_url = URL + payload['report_url'] + '/' + PROJECT_ID
-            query_url = URL + payload['query_url'] + '/' + PROJECT_ID
-            reporter = EngagementReporter(
-                reporter_url, query_url,
-                TOKEN, payload['id'],
-                args
-            )
-            reporter.report_findings(failed_thresholds)
-        
-
-except Exception:
-    print(format_exc())
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4])
@@ -0,0 +1,54 @@
+import gzip
+import os
+from tempfile import SpooledTemporaryFile
+
+RESULTS_GZIP_LEVEL = int(os.environ.get("RESULTS_GZIP_LEVEL", 9))
+RESULTS_SPOOL_SIZE = int(os.environ.get("RESULTS_SPOOL_SIZE", 8 * 1024 * 1024))
+CSV_HEADER = "timestamp,name,identifier,type,loop,load_time,dom,tti,fcp,lcp,cls,tbt,fvc,lvc,file_name\n"
+
+
+def csv_row(record):
+    metrics = record['metrics']
+    return (f"{metrics['timestamps']},{record['name']},{record['identifier']},{record['type']},{record['loop']},"
+            f"{metrics['load_time']},{metrics['dom_processing']},"
+            f"{metrics['time_to_interactive']},{metrics['first_contentful_paint']},"
+            f"{metrics['largest_contentful_paint']},"
+            f"{metrics['cumulative_layout_shift']},{metrics['total_blocking_time']},"
+            f"{metrics['first_visual_change']},{metrics['last_visual_change']},"
+            f"{record['file_name']}\n")
+
+
+class ResultsWriter(object):
+    """Gzipped results CSV that is written as records come in.
+
+    The compressed rows go into a spooled buffer that only touches the disk once it outgrows RESULTS_SPOOL_SIZE.
+    """
+
+    def __init__(self, report_id, level=RESULTS_GZIP_LEVEL, spool_size=RESULTS_SPOOL_SIZE):
+        self.file_name = f"{report_id}.csv.gz"
+        self.buffer = SpooledTemporaryFile(max_size=spool_size)
+        self.gzip = gzip.GzipFile(filename=f"{report_id}.csv", mode='wb', compresslevel=level, fileobj=self.buffer)
+        self.gzip.write(CSV_HEADER.encode('utf-8'))
+        self.rows = 0
+
+    def append(self, record):
+        self.append_row(csv_row(record))
+
+    def append_row(self, row):
+        self.gzip.write(row.encode('utf-8'))
+        self.rows += 1
+
+    def close(self):
+        if not self.gzip.closed:
+            self.gzip.close()
+        return self.buffer
+
+
+class ResultsRows(object):
+    """Keeps the CSV rows of a shard for the merge step instead of writing the CSV."""
+
+    def __init__(self):
+        self.rows = []
+
+    def append(self, record):
+        self.rows.append(csv_row(record))
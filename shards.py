@@ -0,0 +1,86 @@
+"""Sharded runs: the url list is split into contiguous shards that are tested and processed by local workers.
+
+    python3 shards.py split <script> <shards> <shards_dir>
+
+writes the url list of every shard to ``<shards_dir><shard>/<script name>`` and prints how many shards there are.
+Every worker leaves a partial result in its shard directory, the merge step reports the run from them.
+"""
+import json
+import os
+import shutil
+import sys
+
+# set for each worker of a sharded run, its results become a partial result instead of the report
+SHARD_INDEX = os.environ.get("SHARD_INDEX")
+SHARDS_DIR = os.environ.get("SHARDS_DIR", "/tmp/shards/")
+# the merge step of a sharded run, it reports the run from the partial results of the shards
+RESULTS_MERGE = os.environ.get("RESULTS_MERGE", "false").lower() == "true"
+PARTIAL_NAME = "partial.json"
+
+
+def split_urls(script, shards, shards_dir=SHARDS_DIR):
+    """Split the urls of ``script`` into at most ``shards`` contiguous parts, return how many there are.
+
+    Contiguous parts keep the pages of the merged run in the order of the url list, as in a single run.
+    """
+    with open(script, "r") as f:
+        urls = [line for line in f if line.strip()]
+    size = -(-len(urls) // max(1, shards)) or 1
+    parts = [urls[n:n + size] for n in range(0, len(urls), size)]
+    shutil.rmtree(shards_dir, ignore_errors=True)
+    for shard, part in enumerate(parts):
+        os.makedirs(os.path.join(shards_dir, str(shard)))
+        with open(os.path.join(shards_dir, str(shard), os.path.basename(script)), "w") as f:
+            f.writelines(part)
+    return len(parts)
+
+
+def save_partial(shard, timestamp, metrics, rows, thresholds, shards_dir=SHARDS_DIR):
+    """Leave what the merge needs of a shard: its metrics, CSV rows and page threshold outcomes."""
+    partial = {
+        "shard": int(shard),
+        "timestamp": timestamp,
+        "metrics": metrics.state(),
+        "rows": rows,
+        "thresholds": {"total": thresholds.total, "failed": thresholds.failed,
+                       "failed_thresholds": thresholds.failed_thresholds},
+    }
+    file_name = os.path.join(shards_dir, str(shard), PARTIAL_NAME)
+    with open(f"{file_name}.part", "w") as f:
+        json.dump(partial, f)
+    os.replace(f"{file_name}.part", file_name)
+
+
+def load_partials(shards_dir=SHARDS_DIR):
+    """Partial results of the shards in shard order, a shard that left none is reported and skipped."""
+    partials = []
+    shards = sorted(int(name) for name in os.listdir(shards_dir) if name.isdigit())
+    for shard in shards:
+        try:
+            with open(os.path.join(shards_dir, str(shard), PARTIAL_NAME), "r") as f:
+                partials.append(json.load(f))
+        except (OSError, ValueError):
+            print(f"Shard {shard} left no results, the report misses its pages")
+    print(f"Merging {len(partials)} of {len(shards)} shards")
+    return partials
+
+
+def merge_partials(partials, metrics, results_writer, thresholds):
+    """Add the shards to the metrics, CSV and thresholds of the run in shard order, which is page order."""
+    for partial in partials:
+        metrics.merge(partial["metrics"])
+        for row in partial["rows"]:
+            results_writer.append_row(row)
+        outcomes = partial["thresholds"]
+        thresholds.add_outcomes(outcomes["total"], outcomes["failed"], outcomes["failed_thresholds"])
+
+
+def main():
+    if len(sys.argv) != 5 or sys.argv[1] != "split":
+        print(__doc__)
+        sys.exit(1)
+    print(split_urls(sys.argv[2], int(sys.argv[3]), sys.argv[4]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import operator
+import os
+from collections import namedtuple
+
+THRESHOLDS_VERBOSE = os.environ.get("THRESHOLDS_VERBOSE", "false").lower() == "true"
+COMPARISONS = {'gte': operator.ge, 'lte': operator.le, 'gt': operator.gt, 'lt': operator.lt, 'eq': operator.eq}
+
+Rule = namedtuple("Rule", ["threshold", "target", "aggregation", "compare", "value"])
+ThresholdResult = namedtuple("ThresholdResult", ["threshold", "page", "actual_value", "failed"])
+
+
+def never(actual, expected):
+    return False
+
+
+def compile_rule(th):
+    return Rule(th, th["target"], th["aggregation"], COMPARISONS.get(th["comparison"], never), th["value"])
+
+
+class ThresholdEngine(object):
+    """Thresholds indexed by scope once, evaluated a whole page (or the whole run) per call.
+
+    A rule is failed when ``actual <comparison> value`` holds, an unknown comparison never fails.
+    Totals and failed thresholds are accumulated over every call.
+    """
+
+    def __init__(self, thresholds, verbose=THRESHOLDS_VERBOSE):
+        self.verbose = verbose
+        self.all_rules = []
+        self.every_rules = []
+        self.page_rules = {}
+        for th in thresholds:
+            rule = compile_rule(th)
+            if th["scope"] == "all":
+                self.all_rules.append(rule)
+            elif th["scope"] == "every":
+                self.every_rules.append(rule)
+            else:
+                self.page_rules.setdefault(str(th["scope"]), []).append(rule)
+        self.total = 0
+        self.failed = 0
+        self.failed_thresholds = []
+
+    def evaluate_page(self, page, aggregated_result):
+        results = []
+        for rule in self.every_rules:
+            actual = aggregated_result.get(rule.target)
+            results.append(ThresholdResult(rule.threshold, page, actual, rule.compare(actual, rule.value)))
+        for rule in self.page_rules.get(str(page), []):
+            actual = aggregated_result.get(rule.target)
+            results.append(ThresholdResult(rule.threshold, None, actual, rule.compare(actual, rule.value)))
+        for result in results:
+            if result.failed:
+                threshold = dict(**result.threshold)
+                threshold['actual_value'] = result.actual_value
+                if result.page is not None:
+                    threshold['page'] = result.page
+                self.failed_thresholds.append(threshold)
+        self._account(page, results)
+        return results
+
+    def evaluate_all(self, summary):
+        """``summary`` is ``util.summarize_results`` of the whole run."""
+        results = []
+        for rule in self.all_rules:
+            values = summary[rule.target]
+            if not values:
+                print(f"No {rule.target} samples were collected, skipping the {rule.aggregation} threshold")
+                continue
+            if rule.aggregation not in values:
+                raise Exception(f"No such aggregation {rule.aggregation}")
+            actual = values[rule.aggregation]
+            results.append(ThresholdResult(rule.threshold, None, actual, rule.compare(actual, rule.value)))
+            if results[-1].failed:
+                self.failed_thresholds.append(dict(actual_value=actual, **rule.threshold))
+        self._account("all", results)
+        return results
+
+    def add_outcomes(self, total, failed, failed_thresholds):
+        """Account thresholds evaluated somewhere else, e.g. the page thresholds of a shard."""
+        self.total += total
+        self.failed += failed
+        self.failed_thresholds.extend(failed_thresholds)
+
+    def _account(self, scope, results):
+        failed = sum(1 for result in results if result.failed)
+        self.total += len(results)
+        self.failed += failed
+        if not results:
+            return
+        for result in results:
+            if result.failed or self.verbose:
+                th = result.threshold
+                print(f"Threshold: {th['scope']} {th['target']} {th['aggregation']} value {result.actual_value}"
+                      f" {'violates' if result.failed else 'comply with'} rule {th['comparison']} {th['value']}"
+                      f" [{'FAILED' if result.failed else 'PASSED'}]")
+        print(f"Thresholds for {scope}: {len(results) - failed} passed, {failed} failed")
@@ -0,0 +1,110 @@
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+# minio_tests_reader.py runs in its own process, its phases are handed over through this file
+TESTS_READER_TIMINGS = os.environ.get("TESTS_READER_TIMINGS", "/tmp/tests_reader_timings.json")
+
+
+def cpu_time(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Timings(object):
+    """Wall and CPU time of processing phases, per page for the phases that run for a page.
+
+    Every measurement is kept as a ``(phase, page, wall, cpu)`` record, ``summary`` adds them up.
+    CPU time is the time of the measuring thread, so upload threads running meanwhile are not counted.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.lock = Lock()
+        self.started = time.perf_counter()
+        # CPU time used before the run, a worker process runs many
+        self.cpu_base = (0.0, 0.0)
+
+    def reset(self):
+        """Drop the records and start over, for the next run of a worker process."""
+        with self.lock:
+            self.records = []
+        self.started = time.perf_counter()
+        self.cpu_base = (cpu_time(resource.RUSAGE_SELF), cpu_time(resource.RUSAGE_CHILDREN))
+
+    @contextmanager
+    def phase(self, name, page=None):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, page, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add(self, name, page, wall, cpu):
+        with self.lock:
+            self.records.append((name, page, wall, cpu))
+
+    def timed_chunks(self, name, chunks):
+        """Time a generator from its first to its last chunk, in the thread that consumes it."""
+        with self.phase(name):
+            yield from chunks
+
+    def mark(self):
+        return len(self.records)
+
+    def take(self, mark):
+        """Remove and return the records added since ``mark``, to hand them over to another process."""
+        with self.lock:
+            records = self.records[mark:]
+            del self.records[mark:]
+        return records
+
+    def extend(self, records):
+        with self.lock:
+            self.records.extend(tuple(each) for each in records)
+
+    def save(self, file_name):
+        with open(file_name, "w") as f:
+            json.dump(self.records, f)
+
+    def load(self, file_name):
+        try:
+            with open(file_name, "r") as f:
+                self.extend(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    def summary(self, uploads=None):
+        phases, pages = {}, {}
+        with self.lock:
+            records = list(self.records)
+        for name, page, wall, cpu in records:
+            phase = phases.setdefault(name, {"count": 0, "wall": 0.0, "cpu": 0.0})
+            phase["count"] += 1
+            phase["wall"] += wall
+            phase["cpu"] += cpu
+            if page is not None:
+                page_phase = pages.setdefault(page, {}).setdefault(name, {"wall": 0.0, "cpu": 0.0})
+                page_phase["wall"] += wall
+                page_phase["cpu"] += cpu
+        for each in list(phases.values()) + [phase for page in pages.values() for phase in page.values()]:
+            each["wall"] = round(each["wall"], 4)
+            each["cpu"] = round(each["cpu"], 4)
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        summary = {
+            "wall": round(time.perf_counter() - self.started, 4),
+            "cpu": round(own.ru_utime + own.ru_stime - self.cpu_base[0], 4),
+            "children_cpu": round(children.ru_utime + children.ru_stime - self.cpu_base[1], 4),
+            # kilobytes on linux
+            "peak_memory_kb": own.ru_maxrss,
+            "children_peak_memory_kb": children.ru_maxrss,
+            "phases": phases,
+            "pages": pages,
+        }
+        if uploads is not None:
+            summary["uploads"] = uploads
+        return summary
@@ -0,0 +1,362 @@
+import heapq
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from itertools import count
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+from traceback import format_exc
+from uuid import uuid4
+
+import requests
+from requests.adapters import HTTPAdapter
+
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 8))
+UPLOAD_RETRIES = int(os.environ.get("UPLOAD_RETRIES", 3))
+UPLOAD_BACKOFF = float(os.environ.get("UPLOAD_BACKOFF", 0.5))
+# answers that are retried besides 5xx, any other status below 200 or from 300 on fails the upload right away
+RETRY_STATUSES = (408, 429)
+# seconds to wait for the server to take more of the body or to answer, a dropped connection fails the attempt
+UPLOAD_TIMEOUT = float(os.environ.get("UPLOAD_TIMEOUT", 120))
+# files from this size on are read from disk while they are sent instead of being encoded in memory first
+UPLOAD_STREAM_BYTES = int(os.environ.get("UPLOAD_STREAM_BYTES", 4 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# more than 1 sends small files in multipart requests of several ``file`` parts, the server has to accept them
+UPLOAD_BATCH_FILES = int(os.environ.get("UPLOAD_BATCH_FILES", 1))
+UPLOAD_BATCH_BYTES = int(os.environ.get("UPLOAD_BATCH_BYTES", 8 * 1024 * 1024))
+# bigger files (videos) always get a request of their own
+UPLOAD_BATCH_FILE_BYTES = int(os.environ.get("UPLOAD_BATCH_FILE_BYTES", 1024 * 1024))
+# bytes per second the media and bulk uploads may send together, 0 sends them as fast as they go
+UPLOAD_BANDWIDTH = int(os.environ.get("UPLOAD_BANDWIDTH", 0))
+# upload classes, a free upload thread takes the queued upload of the lowest class first
+PRIORITY_RESULTS = 0  # CSV, html, static files, timings: what the report needs to be read
+PRIORITY_MEDIA = 1  # filmstrip frames and screenshots
+PRIORITY_BULK = 2  # videos and the distributed report archive
+
+
+class Uploader(object):
+    """Uploads artifacts over a pooled keep-alive session from a bounded thread pool.
+
+    ``submit`` returns immediately; ``wait`` is the completion barrier for everything submitted so far, or for
+    the uploads of a priority class and the ones before it. Queued uploads go out in priority order, an upload
+    already being sent is never held back. ``bandwidth`` caps the bytes per second of the classes after
+    PRIORITY_RESULTS, of every class while ``limit_results`` is set.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF,
+                 stream_bytes=UPLOAD_STREAM_BYTES, timeout=UPLOAD_TIMEOUT, bandwidth=UPLOAD_BANDWIDTH):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.stream_bytes = stream_bytes
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = TimeoutAdapter(timeout, pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = None
+        # (priority, sequence, file_name, send, files, future) of the uploads no thread has taken yet
+        self.queue = []
+        self.sequence = count()
+        # (priority, future) of the uploads not waited for yet
+        self.futures = []
+        self.limit = BandwidthLimit(bandwidth).take if bandwidth > 0 else None
+        # the results are capped too while the measured test still runs
+        self.limit_results = False
+        self.lock = Lock()
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def submit(self, url, file_name, source, params=None, headers=None, priority=PRIORITY_RESULTS):
+        """Upload ``source`` as ``file_name``, ``source`` is the content itself (bytes) or the path of a file.
+
+        Every attempt reads a file again from disk, so a retry sends the whole object again.
+        """
+        if isinstance(source, bytes):
+            def send_content(limit):
+                if limit:
+                    limit(len(source))
+                return self.session.post(url, params=params, files={'file': (file_name, source)},
+                                         allow_redirects=True, headers=headers, timeout=self.timeout), len(source)
+            return self._submit(file_name, send_content, priority=priority)
+
+        def send(limit):
+            with open(source, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.stream_bytes:
+                    if limit:
+                        limit(size)
+                    return self.session.post(url, params=params, files={'file': (file_name, f)},
+                                             allow_redirects=True, headers=headers, timeout=self.timeout), size
+                boundary = uuid4().hex
+                file_headers = dict(headers or {})
+                file_headers['Content-Type'] = f"multipart/form-data; boundary={boundary}"
+                body = MultipartFileBody(file_name, f, size, boundary, limit=limit)
+                return self.session.post(url, params=params, data=body, allow_redirects=True,
+                                         headers=file_headers, timeout=self.timeout), size
+        return self._submit(file_name, send, priority=priority)
+
+    def submit_file(self, url, file_name, f, params=None, headers=None, priority=PRIORITY_RESULTS):
+        """Upload the open file ``f`` from its start with a Content-Length, e.g. a spooled temporary file."""
+        def send(limit):
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(0)
+            boundary = uuid4().hex
+            file_headers = dict(headers or {})
+            file_headers['Content-Type'] = f"multipart/form-data; boundary={boundary}"
+            body = MultipartFileBody(file_name, f, size, boundary, limit=limit)
+            return self.session.post(url, params=params, data=body, allow_redirects=True,
+                                     headers=file_headers, timeout=self.timeout), size
+        return self._submit(file_name, send, priority=priority)
+
+    def submit_batch(self, url, uploads, params=None, headers=None, priority=PRIORITY_RESULTS):
+        """Upload several ``(file_name, source)`` pairs in one multipart request, a ``file`` part each."""
+        def send(limit):
+            with ExitStack() as stack:
+                files, size = [], 0
+                for file_name, source in uploads:
+                    if isinstance(source, bytes):
+                        content = source
+                        size += len(source)
+                    else:
+                        content = stack.enter_context(open(source, 'rb'))
+                        size += os.fstat(content.fileno()).st_size
+                    files.append(('file', (file_name, content)))
+                if limit:
+                    limit(size)
+                return self.session.post(url, params=params, files=files, allow_redirects=True,
+                                         headers=headers, timeout=self.timeout), size
+        return self._submit(f"{uploads[0][0]} and {len(uploads) - 1} more", send, len(uploads), priority)
+
+    def submit_stream(self, url, file_name, chunks_factory, params=None, headers=None, priority=PRIORITY_RESULTS):
+        """Upload the chunks yielded by ``chunks_factory()`` as a streamed multipart body.
+
+        The factory is called again for every retry, so it must be able to produce the content more than once.
+        The length is unknown, so the body goes out with chunked encoding and only the socket timeout of the
+        session applies to it.
+        """
+        def send(limit):
+            boundary = uuid4().hex
+            stream_headers = dict(headers or {})
+            stream_headers['Content-Type'] = f"multipart/form-data; boundary={boundary}"
+            body = CountingStream(multipart_stream(file_name, chunks_factory(), boundary), limit=limit)
+            return self.session.post(url, params=params, data=body, allow_redirects=True,
+                                     headers=stream_headers, timeout=self.timeout), body.size
+        return self._submit(file_name, send, priority=priority)
+
+    def _submit(self, file_name, send, files=1, priority=PRIORITY_RESULTS):
+        future = Future()
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            heapq.heappush(self.queue, (priority, next(self.sequence), file_name, send, files, future))
+            self.futures.append((priority, future))
+            # every task takes whichever upload comes first when a thread gets to it, not this one
+            self.executor.submit(self._send_next)
+        return future
+
+    def _send_next(self):
+        with self.lock:
+            priority, _, file_name, send, files, future = heapq.heappop(self.queue)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._send(file_name, send, files, priority))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _send(self, file_name, send, files=1, priority=PRIORITY_RESULTS):
+        start = perf_counter()
+        size = None
+        limit = self.limit if priority > PRIORITY_RESULTS or self.limit_results else None
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    resp, sent = send(limit)
+                    if 200 <= resp.status_code < 300:
+                        size = sent
+                        return True
+                    print(f"Upload of {file_name} failed with status {resp.status_code}, attempt {attempt + 1}")
+                    if resp.status_code < 500 and resp.status_code not in RETRY_STATUSES:
+                        # the upload itself is refused, sending it again won't help
+                        return False
+                except requests.RequestException:
+                    print(format_exc())
+                except OSError:
+                    # the file itself is unreadable, retrying won't help
+                    print(format_exc())
+                    return False
+                if attempt < self.retries:
+                    sleep(self.backoff * 2 ** attempt)
+            print(f"Giving up on {file_name} after {self.retries + 1} attempts")
+            return False
+        finally:
+            self._account(start, perf_counter(), size, files)
+
+    def _account(self, start, end, size, files):
+        with self.lock:
+            if size is None:
+                self.failed += files
+            else:
+                self.files += files
+                self.bytes += size
+            self.busy += end - start
+            self.first_start = start if self.first_start is None else min(self.first_start, start)
+            self.last_end = end if self.last_end is None else max(self.last_end, end)
+
+    def reset_stats(self):
+        """Start the stats over, for the next run of a worker process."""
+        with self.lock:
+            self.files, self.bytes, self.failed, self.busy = 0, 0, 0, 0.0
+            self.first_start, self.last_end = None, None
+
+    def stats(self):
+        """Files and bytes uploaded so far, ``wall`` runs from the first upload start to the last upload end."""
+        with self.lock:
+            wall = self.last_end - self.first_start if self.first_start is not None else 0.0
+            return {"files": self.files, "bytes": self.bytes, "failed": self.failed, "busy": round(self.busy, 4),
+                    "wall": round(wall, 4), "bytes_per_second": round(self.bytes / wall) if wall else 0}
+
+    def wait(self, priority=None):
+        """Block until every submitted upload (of ``priority`` or a lower class when it is given) is finished,
+        return the number of failed ones."""
+        with self.lock:
+            futures = [future for each, future in self.futures if priority is None or each <= priority]
+            self.futures = [(each, future) for each, future in self.futures
+                            if priority is not None and each > priority]
+        wait(futures)
+        return sum(1 for f in futures if f.exception() or not f.result())
+
+
+def batch_uploads(uploads, max_files=UPLOAD_BATCH_FILES, max_bytes=UPLOAD_BATCH_BYTES,
+                  max_file_bytes=UPLOAD_BATCH_FILE_BYTES):
+    """Group ``(file_name, source)`` pairs into the lists uploaded together, files over ``max_file_bytes`` alone."""
+    if max_files <= 1:
+        return [[upload] for upload in uploads]
+    batches, batch, batch_bytes = [], [], 0
+    for file_name, source in uploads:
+        size = source_size(source)
+        if size is None or size > max_file_bytes:
+            batches.append([(file_name, source)])
+            continue
+        if batch and (len(batch) >= max_files or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append((file_name, source))
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def source_size(source):
+    """Size of an upload source, None when its file can't be read."""
+    if isinstance(source, bytes):
+        return len(source)
+    try:
+        return os.path.getsize(source)
+    except OSError:
+        return None
+
+
+class TimeoutAdapter(HTTPAdapter):
+    """Opens connections with a socket timeout.
+
+    requests 2.20 doesn't apply the ``timeout`` of a request to a chunked body, neither while the body is sent
+    nor while the answer is awaited, the socket timeout still fails a stalled upload.
+    """
+
+    def __init__(self, timeout, **kwargs):
+        # HTTPAdapter.__init__ creates the pool manager
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["timeout"] = self.timeout
+        super().init_poolmanager(*args, **kwargs)
+
+
+class BandwidthLimit(object):
+    """Token bucket shared by the upload threads, ``take`` blocks until ``size`` more bytes may go out.
+
+    Up to a second of traffic goes out at once, above that every taker waits for its share of ``rate``.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = monotonic()
+        self.lock = Lock()
+
+    def take(self, size):
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate) - size
+            self.last = now
+            delay = -self.tokens / self.rate
+        if delay > 0:
+            sleep(delay)
+
+
+class CountingStream(object):
+    """Iterable body that counts the bytes requests pulls from it, ``limit`` is called with every chunk."""
+
+    def __init__(self, chunks, limit=None):
+        self.chunks = chunks
+        self.limit = limit
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.limit:
+                self.limit(len(chunk))
+            self.size += len(chunk)
+            yield chunk
+
+
+class MultipartFileBody(object):
+    """Multipart body of an open file, read a chunk at a time while it is sent.
+
+    The length is known up front, so it goes out with a Content-Length instead of chunked encoding.
+    """
+
+    def __init__(self, file_name, f, size, boundary, chunk_size=UPLOAD_CHUNK_SIZE, limit=None):
+        self.head = multipart_head(file_name, boundary)
+        self.tail = multipart_tail(boundary)
+        self.f = f
+        self.size = size
+        self.chunk_size = chunk_size
+        self.limit = limit
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        for chunk in iter(lambda: self.f.read(self.chunk_size), b''):
+            if self.limit:
+                self.limit(len(chunk))
+            yield chunk
+        yield self.tail
+
+
+def multipart_head(file_name, boundary):
+    return (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+
+
+def multipart_tail(boundary):
+    return f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+
+def multipart_stream(file_name, chunks, boundary):
+    yield multipart_head(file_name, boundary)
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+    yield multipart_tail(boundary)
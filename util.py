@@ -1,98 +1,206 @@
 import math
-import requests
+import multiprocessing
+import hashlib
+import json
 from traceback import format_exc
 import os
 from json import loads
 import sys
 from datetime import datetime
 import pytz
-import re
-import shutil
 import urllib.parse
+from array import array
+from functools import lru_cache, partial
+from archive import list_archive_entries, stream_archive
+from control_plane import ControlPlane
+from html_rewriter import LinkRewriter
+from metrics_store import HistogramStore, MetricsRow, PERCENTILES, REPORT_COMPACT, number
+from page_summary import read_page_summary
+from results_index import SITESPEED_RESULTS, STATIC_DIRS, index_page
+from timings import Timings
+from uploader import Uploader, batch_uploads, PRIORITY_BULK, PRIORITY_MEDIA, PRIORITY_RESULTS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 QUALITY_GATE = int(os.environ.get("QUALITY_GATE", 20))
+AGGREGATIONS = ["min", "max", "avg"] + list(PERCENTILES)
+# below this size sorted() beats the numpy round trip
+NUMPY_MIN_SIZE = int(os.environ.get("NUMPY_MIN_SIZE", 1000))
+# 0 takes the CPUs the container may use, up to PAGE_WORKERS_MAX
+PAGE_WORKERS = int(os.environ.get("PAGE_WORKERS", 0))
+# every page worker hands multi-MB rewritten html back to the parent, more of them only add memory and pickling
+PAGE_WORKERS_MAX = 4
+STATIC_BUCKET = "sitespeedstatic"
+STATIC_MANIFEST_NAME = "sitespeedstatic_manifest.json"
+STATIC_MANIFEST_DIR = os.environ.get("STATIC_MANIFEST_DIR", "/tmp/")
+STATIC_MANIFEST_REMOTE = os.environ.get("STATIC_MANIFEST_REMOTE", "true").lower() == "true"
+STATIC_REFRESH = os.environ.get("STATIC_REFRESH", "false").lower() == "true"
+# upload a filmstrip frame identical to an earlier frame of the same loop only once
+FILMSTRIP_DEDUP = os.environ.get("FILMSTRIP_DEDUP", "true").lower() == "true"
+# seconds the final report PUT may take, it carries every sample of the run
+REPORT_TIMEOUT = float(os.environ.get("REPORT_TIMEOUT", 600))
+# upload classes of the page files by extension, anything else (html, json) goes with the results
+UPLOAD_PRIORITIES = {".jpg": PRIORITY_MEDIA, ".jpeg": PRIORITY_MEDIA, ".png": PRIORITY_MEDIA,
+                     ".webp": PRIORITY_MEDIA, ".mp4": PRIORITY_BULK, ".webm": PRIORITY_BULK}
 integrations = loads(os.environ.get("integrations", '{}'))
 s3_config = integrations.get('system', {}).get('s3_integration', {})
 print("********************* s3_config")
 print(s3_config)
 print("*********************")
+uploader = Uploader()
+timings = Timings()
+control_plane = ControlPlane(timings=timings)
+# file name -> sha256 of the copy stored in the sitespeedstatic bucket
+static_manifest = {}
+static_uploaded = {}
+# (future, file name, sha256) of the static uploads not waited for yet
+static_pending = []
+# static files of this run that failed to upload, the manifest is not saved when there are any
+static_rejected = []
+static_manifest_target = None
+# (galloper url, project, test, env) -> the thresholds fetched last, used when they can't be fetched again
+thresholds_cache = {}
+
+
+def summarize(metrics):
+    """Every supported aggregation of a metric series, the series is sorted only once."""
+    size = len(metrics)
+    if not size:
+        return {}
+    ranks = [0, size - 1] + [int(math.ceil((size * pct) / 100)) - 1 for pct in PERCENTILES.values()]
+    values = None
+    if numpy is not None and size >= NUMPY_MIN_SIZE:
+        ordered = numpy.asarray(metrics)
+        # a list mixing ints and floats turns into floats, it is sorted as it is to report its values unchanged
+        if isinstance(metrics, array) or ordered.dtype.kind in "iu":
+            # only the ranked values are taken out of the sorted array, tolist makes them Python numbers
+            values = numpy.sort(ordered)[ranks].tolist()
+    if values is None:
+        ordered = sorted(metrics)
+        values = [ordered[rank] for rank in ranks]
+    summary = {"min": values[0], "max": values[1], "avg": int(sum(metrics) / size)}
+    summary.update(zip(PERCENTILES, values[2:]))
+    if isinstance(metrics, array):
+        summary = {aggregation: number(value) for aggregation, value in summary.items()}
+    return summary
+
+
+def summarize_results(results):
+    return {metric: summarize(values) for metric, values in results.items() if metric != "timestamps"}
+
+
+def summarize_metrics(metrics):
+    """``summarize_results`` of the run, from the histograms when the metrics store keeps no samples."""
+    if isinstance(metrics, HistogramStore):
+        return metrics.summary(PERCENTILES)
+    return summarize_results(metrics.columns)
+
+
+def prepare_page_results(page, galloper_url, project_id, timestamp):
+    """Rewrite the page html and parse its results, return them with the (file_name, source) pairs to upload."""
+    print(f"processing: {page.path}")
+    duplicates = filmstrip_duplicates(page)
+    uploads = prepare_page_html(page, galloper_url, project_id, timestamp, duplicates)
+    page_results, data_uploads = prepare_page_data(page, timestamp, duplicates)
+    return page_results, uploads + data_uploads
+
+
+def prepare_page_html(page, galloper_url, project_id, timestamp, duplicates=None):
+    if duplicates is None:
+        duplicates = filmstrip_duplicates(page)
+    report_bucket = f"{galloper_url}/api/v1/artifacts/artifact/{project_id}/reports"
+    static_bucket = f"{galloper_url}/api/v1/artifacts/artifact/{project_id}/sitespeedstatic"
+    uploads = []
+    # index.html, metrics.html and results html of every loop
+    for html_file in ["index.html", "metrics.html"] + [each.html for each in page.loops]:
+        with open(f"{page.path}{html_file}", "r", encoding='utf-8') as f:
+            html = f.read()
+        html = update_page_results_html(html, report_bucket, static_bucket, page.page_name, timestamp,
+                                        len(page.loops), page.prefix, duplicates)
+        uploads.append((f"{page.page_name}_{timestamp}_{html_file}", html.encode('utf-8')))
+    return uploads
 
 
-def is_threshold_failed(actual, comparison, expected):
-    if comparison == 'gte':
-        return actual >= expected
-    elif comparison == 'lte':
-        return actual <= expected
-    elif comparison == 'gt':
-        return actual > expected
-    elif comparison == 'lt':
-        return actual < expected
-    elif comparison == 'eq':
-        return actual == expected
-    return False
-
-
-def get_aggregated_value(aggregation, metrics):
-    if aggregation == 'max':
-        return max(metrics)
-    elif aggregation == 'min':
-        return min(metrics)
-    elif aggregation == 'avg':
-        return int(sum(metrics) / len(metrics))
-    elif aggregation == 'pct95':
-        return percentile(metrics, 95)
-    elif aggregation == 'pct50':
-        return percentile(metrics, 50)
-    else:
-        raise Exception(f"No such aggregation {aggregation}")
+def prepare_page_data(page, timestamp, duplicates=None):
+    """Parse the page results and list its media, the html is left alone (it is written when the run ends)."""
+    with timings.phase("page_media_uploads", page.page_name):
+        if duplicates is None:
+            duplicates = filmstrip_duplicates(page)
+        uploads = page_media_uploads(page, timestamp, duplicates)
+    with timings.phase("get_page_results", page.page_name):
+        page_results = get_page_results(page.path)
+    return page_results, uploads
 
 
-def percentile(data, percentile):
-    size = len(data)
-    return sorted(data)[int(math.ceil((size * percentile) / 100)) - 1]
+def prepare_page_job(args):
+    return prepare_page_results(*args)
 
 
-def process_page_results(page_name, path, galloper_url, project_id, token, timestamp, prefix, loops):
-    print(f"processing: {path}")
-    query_params = '?' + urllib.parse.urlencode(s3_config) if s3_config else ''
-    report_bucket = f"{galloper_url}/api/v1/artifacts/artifact/{project_id}/reports"
-    static_bucket = f"{galloper_url}/api/v1/artifacts/artifact/{project_id}/sitespeedstatic"
-    # index.html
-    with open(f"{path}index.html", "r", encoding='utf-8') as f:
-        index_html = f.read()
-    index_html = update_page_results_html(index_html, report_bucket, static_bucket, page_name, timestamp, loops, prefix)
-    with open(f"/{page_name}_{timestamp}_index.html", 'w') as f:
-        f.write(index_html)
-    upload_file(f"{page_name}_{timestamp}_index.html", "/", galloper_url, project_id, token)
-    # metrics.html
-    with open(f"{path}metrics.html", "r", encoding='utf-8') as f:
-        metrics_html = f.read()
-    metrics_html = update_page_results_html(metrics_html, report_bucket, static_bucket, page_name, timestamp, loops,
-                                            prefix)
-    with open(f"/{page_name}_{timestamp}_metrics.html", 'w') as f:
-        f.write(metrics_html)
-    upload_file(f"{page_name}_{timestamp}_metrics.html", "/", galloper_url, project_id, token)
-
-    # results.html
-    for i in range(1, loops + 1):
-        with open(f"{path}{i}.html", "r", encoding='utf-8') as f:
-            results_html = f.read()
-        results_html = update_page_results_html(results_html, report_bucket, static_bucket, page_name, timestamp, loops,
-                                                prefix)
-        with open(f"/{page_name}_{timestamp}_{i}.html", 'w') as f:
-            f.write(results_html)
-        upload_file(f"{page_name}_{timestamp}_{i}.html", "/", galloper_url, project_id, token)
+def prepare_page_html_job(args):
+    print(f"processing html: {args[0].path}")
+    return prepare_page_html(*args)
 
-    upload_page_results_data(path, page_name, timestamp, galloper_url, project_id, token, loops)
 
-    page_results = get_page_results(path)
-    return page_results
+def prepare_page_data_job(args):
+    page, galloper_url, project_id, timestamp = args
+    print(f"processing data: {page.path}")
+    return prepare_page_data(page, timestamp)
+
+
+def timed_page_job(job, args):
+    """Run ``job`` and return its result with the timings it recorded, a pool worker can't record them itself."""
+    mark = timings.mark()
+    with timings.phase("process_page_results", args[0].page_name):
+        result = job(args)
+    return result, timings.take(mark)
+
+
+def available_cpus():
+    """CPUs this process may run on, lowered to the CPU quota of its cgroup; os.cpu_count() is the host's."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        # cgroup v2, "max 100000" when there is no quota
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            # cgroup v1, -1 when there is no quota
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+    if quota in ("max", "-1"):
+        return cpus
+    return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+
+
+def create_page_pool(workers=PAGE_WORKERS):
+    # forked before the upload threads start, workers only touch the disk and never the shared session
+    if not workers:
+        workers = min(available_cpus(), PAGE_WORKERS_MAX)
+    if workers <= 1:
+        return None
+    return multiprocessing.get_context("fork").Pool(workers)
+
+
+def prepare_pages(pool, pages, galloper_url, project_id, timestamp, job=prepare_page_job):
+    """Yield the result of ``job`` (prepare_page_results by default) for every page, in the order of pages."""
+    args = [(page, galloper_url, project_id, timestamp) for page in pages]
+    work = partial(timed_page_job, job)
+    results = map(work, args) if pool is None else pool.imap(work, args)
+    for result, records in results:
+        timings.extend(records)
+        yield result
 
 
 def get_page_results(path):
     json_file = f"{path}data/browsertime.pageSummary.json"
-    with open(json_file, "r") as f:
-        page = loads(f.read())
+    page = read_page_summary(json_file)
     page_result = {"timestamps": [each for each in page["timestamps"]],
                    "load_time": [each for each in page["fullyLoaded"]],
                    "speed_index": [each["SpeedIndex"] for each in page["visualMetrics"]],
@@ -114,7 +222,8 @@ def get_page_results(path):
 
 
 def get_record(page_name, page_results, timestamp, loop):
-    if loop == -1:
+    """``page_results`` is the aggregated result for loop -1, a page result or a ``MetricsRow`` of the loop."""
+    if loop == -1 or isinstance(page_results, MetricsRow):
         page_result = page_results
     else:
         page_result = {"time_to_interactive": 0}
@@ -139,7 +248,11 @@ def get_record(page_name, page_results, timestamp, loop):
 
 
 def finalize_report(galloper_url, project_id, token, report_id, test_thresholds_total, test_thresholds_failed,
-                    all_results):
+                    metrics):
+    """``metrics`` is the metrics store of the run, its series (or histogram summaries) go out as the report results.
+
+    Return the future of the response, it has to be waited for: unlike status updates the report is not best-effort.
+    """
     time = datetime.now(tz=pytz.timezone("UTC"))
     status = {"status": "Finished", "percentage": 100, "description": "Test is finished"}
     exception_message = ""
@@ -156,7 +269,6 @@ def finalize_report(galloper_url, project_id, token, report_id, test_thresholds_
         "report_id": report_id,
         "time": time.strftime('%Y-%m-%d %H:%M:%S'),
         "status": status,
-        "results": all_results,
         "thresholds_total": test_thresholds_total,
         "thresholds_failed": test_thresholds_failed,
         "exception": exception_message
@@ -165,141 +277,337 @@ def finalize_report(galloper_url, project_id, token, report_id, test_thresholds_
         'Authorization': f"Bearer {token}",
         'Content-type': 'application/json'
     }
+    separators = (",", ":") if REPORT_COMPACT else (", ", ": ")
+    body = json.dumps(report_data, separators=separators)[:-1]
+    body += f'{separators[0]}"results"{separators[1]}{metrics.to_json()}'
+    if isinstance(metrics, HistogramStore):
+        # results keep their schema, the histograms go under a key of their own
+        body += f'{separators[0]}"histograms"{separators[1]}{metrics.histograms_json()}'
+    body += '}'
+    # a progress update arriving after the final status would put the report back in progress
+    control_plane.flush_status()
+
+    def parse(resp):
+        if resp is None or resp.status_code >= 400:
+            print(f"Report was not finalized: {resp.text if resp is not None else 'request failed'}")
+        return resp
+    return control_plane.request("PUT", f"{galloper_url}/api/v1/ui_performance/reports/{project_id}", parse=parse,
+                                 data=body.encode('utf-8'), headers=headers, timeout=REPORT_TIMEOUT,
+                                 phase="finalize_report")
+
+
+def fetch_thresholds(galloper_url, project_id, token, test_name, env):
+    """Future of the thresholds of the test, the ones fetched last time (or an empty list) when they can't be."""
+    key = (galloper_url, project_id, test_name, env)
+    future = control_plane.get_json(
+        f"{galloper_url}/api/v1/ui_performance/thresholds/{project_id}?test={test_name}&env={env}&order=asc",
+        default=thresholds_cache.get(key, []), headers={'Authorization': f"Bearer {token}"})
+
+    def remember(done):
+        if not done.exception():
+            thresholds_cache[key] = done.result()
+    future.add_done_callback(remember)
+    return future
+
+
+def report_progress(galloper_url, project_id, token, report_id, done, total=None):
+    """Report the pages processed so far, the percentage runs from 10 (test started) to 90 once all are done."""
+    if total:
+        status = {"status": "In progress", "percentage": 10 + 80 * done // total,
+                  "description": f"Processing results: {done} of {total} pages"}
+    else:
+        status = {"status": "In progress", "percentage": 10, "description": f"{done} pages processed"}
+    control_plane.report_status(f"{galloper_url}/api/v1/ui_performance/report_status/{project_id}/{report_id}",
+                                status, headers={'content-type': 'application/json',
+                                                 'Authorization': f'bearer {token}'})
+
+
+
+def upload_file(file_name, source, galloper_url, project_id, token, bucket="reports", priority=PRIORITY_RESULTS):
+    """Upload ``source`` (bytes, or the path of a file) as ``file_name``."""
+    return uploader.submit(f"{galloper_url}/api/v1/artifacts/artifacts/{project_id}/{bucket}", file_name, source,
+                           params=s3_config, headers={'Authorization': f"Bearer {token}"}, priority=priority)
+
+
+def upload_priority(file_name):
+    return UPLOAD_PRIORITIES.get(os.path.splitext(file_name)[1].lower(), PRIORITY_RESULTS)
+
+
+def upload_files(uploads, galloper_url, project_id, token, bucket="reports"):
+    """Upload (file_name, source) pairs in the priority class of their file type, small files of a class share
+    requests when UPLOAD_BATCH_FILES is above 1."""
+    classes = {}
+    for upload in uploads:
+        classes.setdefault(upload_priority(upload[0]), []).append(upload)
+    futures = []
+    for priority, class_uploads in sorted(classes.items()):
+        for batch in batch_uploads(class_uploads):
+            if len(batch) == 1:
+                futures.append(upload_file(*batch[0], galloper_url, project_id, token, bucket=bucket,
+                                           priority=priority))
+            else:
+                futures.append(uploader.submit_batch(
+                    f"{galloper_url}/api/v1/artifacts/artifacts/{project_id}/{bucket}", batch, params=s3_config,
+                    headers={'Authorization': f"Bearer {token}"}, priority=priority))
+    return futures
+
+
+def wait_for_uploads(priority=None):
+    """Wait for the uploads, or only for the ones of ``priority`` and the classes before it."""
+    with timings.phase("wait_for_uploads" if priority is None else "wait_for_results"):
+        failed = uploader.wait(priority)
+        record_static_uploads()
+        if static_uploaded and not static_rejected:
+            save_static_manifest()
+            failed += uploader.wait(priority)
+    if failed:
+        print(f"{failed} files failed to upload")
+
+
+def page_media_uploads(page, timestamp, duplicates=()):
+    """The media of the page as (file_name, source) pairs, uploaded from where they are under the page's name.
+
+    Frames and screenshots carry their loop in the name, the same frame names come back in every loop.
+    """
+    path, page_name = page.path, page.page_name
+    skipped = {(loop, name) for loop, name, stored in duplicates}
+    uploads = []
+    for each in page.loops:
+        for name in each.filmstrip:
+            if (each.loop, name) not in skipped:
+                uploads.append((f"{page_name}_{timestamp}_{each.loop}_{name}",
+                                f"{path}data/filmstrip/{each.loop}/{name}"))
+        for name in each.screenshots:
+            uploads.append((f"{page_name}_{timestamp}_{each.loop}_{name}",
+                            f"{path}data/screenshots/{each.loop}/{name}"))
+        if each.video:
+            uploads.append((f"{page_name}_{timestamp}_{each.video}", f"{path}data/video/{each.video}"))
+    return uploads
+
+
+def filmstrip_duplicates(page):
+    """(loop, frame, stored frame) of every frame with the same content as an earlier frame of its loop."""
+    if not FILMSTRIP_DEDUP:
+        return ()
+    duplicates = []
+    for each in page.loops:
+        stored = {}
+        for name in sorted(each.filmstrip):
+            sha = file_sha256(f"{page.path}data/filmstrip/{each.loop}/{name}")
+            if sha in stored:
+                duplicates.append((each.loop, name, stored[sha]))
+            else:
+                stored[sha] = name
+    return tuple(duplicates)
+
+
+def file_sha256(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_static_manifest(galloper_url, project_id, token):
+    global static_manifest_target
+    if not STATIC_REFRESH and static_manifest_target == (galloper_url, project_id, token):
+        # a worker keeps the manifest of its previous runs, with what they uploaded
+        return static_manifest
+    static_manifest_target = (galloper_url, project_id, token)
+    static_manifest.clear()
+    if STATIC_REFRESH:
+        print("Static files refresh is forced")
+        return static_manifest
     try:
-        requests.put(f"{galloper_url}/api/v1/ui_performance/reports/{project_id}", json=report_data,
-                     headers=headers)
-    except Exception:
-        print(format_exc())
-
-
-
-def upload_file(file_name, file_path, galloper_url, project_id, token, bucket="reports"):
-    file = {'file': open(f"{file_path}{file_name}", 'rb')}
-    try:
-        requests.post(f"{galloper_url}/api/v1/artifacts/artifacts/{project_id}/{bucket}", params=s3_config,
-                      files=file, allow_redirects=True, headers={'Authorization': f"Bearer {token}"})
+        with open(static_manifest_file(galloper_url, project_id), "r") as f:
+            static_manifest.update(loads(f.read()))
+    except FileNotFoundError:
+        pass
     except Exception:
         print(format_exc())
-
-
-def upload_page_results_data(path, page_name, timestamp, galloper_url, project_id, token, loops):
-    for i in range(1, loops + 1):
-        filmstrip_files = os.listdir(f"{path}data/filmstrip/{i}/")
-        for each in filmstrip_files:
-            os.rename(f"{path}data/filmstrip/{i}/{each}", f"{path}data/filmstrip/{i}/{page_name}_{timestamp}_{each}")
-            upload_file(f"{page_name}_{timestamp}_{each}", f"{path}data/filmstrip/{i}/", galloper_url, project_id,
-                        token)
-        screenshot_files = os.listdir(f"{path}data/screenshots/{i}/")
-        for each in screenshot_files:
-            os.rename(f"{path}data/screenshots/{i}/{each}",
-                      f"{path}data/screenshots/{i}/{page_name}_{timestamp}_{each}")
-            upload_file(f"{page_name}_{timestamp}_{each}", f"{path}data/screenshots/{i}/", galloper_url, project_id,
-                        token)
-
-        os.rename(f"{path}data/video/{i}.mp4", f"{path}data/video/{page_name}_{timestamp}_{i}.mp4")
-        upload_file(f"{page_name}_{timestamp}_{i}.mp4", f"{path}data/video/", galloper_url, project_id, token)
-
-
-def upload_static_files(path, galloper_url, project_id, token):
-    static_bucket = "sitespeedstatic"
-    for each in ["css", "img", "img/ico", "js", "font"]:
-        files = [f for f in os.listdir(f"{path}{each}/") if os.path.isfile(f"{path}{each}/{f}")]
-        for file in files:
-            upload_file(file, f"{path}{each}/", galloper_url, project_id, token, bucket=static_bucket)
+    if STATIC_MANIFEST_REMOTE:
+        try:
+            res = uploader.session.get(
+                f"{galloper_url}/api/v1/artifacts/artifact/{project_id}/{STATIC_BUCKET}/{STATIC_MANIFEST_NAME}",
+                params=s3_config, allow_redirects=True, headers={'Authorization': f"Bearer {token}"})
+            if res.status_code == 200:
+                static_manifest.update(res.json())
+        except Exception:
+            print(format_exc())
+    return static_manifest
+
+
+def record_static_uploads():
+    """Move the static uploads that are done into static_uploaded with their hash, the failed ones to static_rejected.
+
+    Read from the futures after waiting, done callbacks may still be running when ``wait`` returns.
+    """
+    for each in list(static_pending):
+        future, name, sha = each
+        if future.done():
+            static_pending.remove(each)
+            if not future.exception() and future.result():
+                static_uploaded[name] = sha
+            else:
+                static_rejected.append(name)
+                print(f"Static file {name} was not uploaded, the static files manifest is not saved")
+
+
+def static_manifest_file(galloper_url, project_id):
+    """The local manifest of a Galloper project, a worker or a shared STATIC_MANIFEST_DIR may serve several."""
+    target = hashlib.sha256(f"{galloper_url}|{project_id}".encode('utf-8')).hexdigest()[:16]
+    return f"{STATIC_MANIFEST_DIR}{STATIC_MANIFEST_NAME[:-len('.json')]}_{target}.json"
+
+
+def save_static_manifest():
+    if not static_manifest_target:
+        return
+    static_manifest.update(static_uploaded)
+    static_uploaded.clear()
+    galloper_url, project_id, token = static_manifest_target
+    file_name = static_manifest_file(galloper_url, project_id)
+    # shards of a run share the manifest file
+    part = f"{file_name}.{os.getpid()}.part"
+    with open(part, "w") as f:
+        f.write(json.dumps(static_manifest, sort_keys=True))
+    os.replace(part, file_name)
+    if STATIC_MANIFEST_REMOTE:
+        upload_file(STATIC_MANIFEST_NAME, file_name, galloper_url, project_id, token, bucket=STATIC_BUCKET)
+
+
+def upload_static_files(path, galloper_url, project_id, token, static_files=None):
+    """``static_files`` maps every static directory to its files, they are listed from ``path`` when not given."""
+    with timings.phase("upload_static_files"):
+        manifest = load_static_manifest(galloper_url, project_id, token)
+        static_rejected.clear()
+        skipped, queued = 0, 0
+        for each in STATIC_DIRS:
+            if static_files is not None:
+                files = static_files.get(each, [])
+            else:
+                files = [f for f in os.listdir(f"{path}{each}/") if os.path.isfile(f"{path}{each}/{f}")]
+            for file in files:
+                sha = file_sha256(f"{path}{each}/{file}")
+                if manifest.get(file) == sha:
+                    skipped += 1
+                    continue
+                future = upload_file(file, f"{path}{each}/{file}", galloper_url, project_id, token,
+                                     bucket=STATIC_BUCKET)
+                static_pending.append((future, file, sha))
+                queued += 1
+        print(f"Static files: {skipped} already uploaded, {queued} queued")
 
 
 def upload_distributed_report_files(path, timestamp, galloper_url, project_id, token, loops):
     query_params = '?' + urllib.parse.urlencode(s3_config) if s3_config else ''
     report_bucket = f"{galloper_url}/api/v1/artifacts/artifact/{project_id}/reports{query_params}"
     static_bucket = f"{galloper_url}/api/v1/artifacts/artifact/{project_id}/sitespeedstatic{query_params}"
-    for each in ["index.html", "detailed.html", "pages.html", "domains.html", "toplist.html", "assets.html",
-                 "settings.html", "help.html"]:
-        with open(f"{path}{each}", "r", encoding='utf-8') as f:
-            html = f.read()
-        html = update_page_results_html(html, report_bucket, static_bucket, "", timestamp, loops, "")
-        with open(f"/{timestamp}_{each}", 'w') as f:
-            f.write(html)
-        upload_file(f"{timestamp}_{each}", "/", galloper_url, project_id, token)
-
-
-def aggregate_results(page_result):
+    with timings.phase("upload_distributed_report_files"):
+        for each in ["index.html", "detailed.html", "pages.html", "domains.html", "toplist.html", "assets.html",
+                     "settings.html", "help.html"]:
+            with open(f"{path}{each}", "r", encoding='utf-8') as f:
+                html = f.read()
+            html = update_page_results_html(html, report_bucket, static_bucket, "", timestamp, loops, "")
+            upload_file(f"{timestamp}_{each}", html.encode('utf-8'), galloper_url, project_id, token)
+
+
+def aggregate_results(page_result, summary=None, aggregation=None):
+    aggregation = aggregation or sys.argv[4]
+    if aggregation not in AGGREGATIONS:
+        raise Exception(f"No such aggregation {aggregation}")
+    summary = summary or summarize_results(page_result)
     aggregated_result = {"time_to_interactive": 0}  # there is no TTI in browsertime json
     for metric in list(page_result.keys()):
         if metric == "timestamps":
             aggregated_result[metric] = "0"
         else:
-            aggregated_result[metric] = get_aggregated_value(sys.argv[4], page_result[metric])
+            aggregated_result[metric] = summary[metric][aggregation]
     return aggregated_result
 
 
-def update_page_results_html(html, report_bucket, static_bucket, page_name, timestamp, loops, prefix):
-    html = html.replace(f'<li><a href="{prefix}assets.html">Assets</a></li>',
-                        f'<li><a href="{report_bucket}/{timestamp}_assets.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}">Assets</a></li> <li><a href="{timestamp}_distributed_report.zip?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}">Report</a></li>')
-    html = html.replace(f'href="{prefix}css/index.min.css"', f'href="{static_bucket}/index.min.css?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'href="{prefix}img/ico/sitespeed.io-144.png"', f'href="{static_bucket}/sitespeed.io-144.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'href="{prefix}img/ico/sitespeed.io-114.png"', f'href="{static_bucket}/sitespeed.io-114.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'href="{prefix}img/ico/sitespeed.io-72.png"', f'href="{static_bucket}/sitespeed.io-72.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'href="{prefix}img/ico/sitespeed.io.ico"', f'href="{static_bucket}/sitespeed.io.ico?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}img/sitespeed.io-logo.png"', f'src="{static_bucket}/sitespeed.io-logo.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}img/coach.png"', f'src="{static_bucket}/coach.png?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}js/perf-cascade.min.js"', f'src="{static_bucket}/perf-cascade.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}js/sortable.min.js"', f'src="{static_bucket}/sortable.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}js/chartist.min.js"', f'src="{static_bucket}/chartist.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}js/chartist-plugin-axistitle.min.js"',
-                        f'src="{static_bucket}/chartist-plugin-axistitle.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}js/chartist-plugin-tooltip.min.js"',
-                        f'src="{static_bucket}/chartist-plugin-tooltip.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}js/chartist-plugin-legend.min.js"',
-                        f'src="{static_bucket}/chartist-plugin-legend.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'src="{prefix}js/video.core.novtt.min.js"', f'src="{static_bucket}/video.core.novtt.min.js?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
-    html = html.replace(f'href="{prefix}help.html', f'href="{report_bucket}/{timestamp}_help.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}')
+def update_page_results_html(html, report_bucket, static_bucket, page_name, timestamp, loops, prefix,
+                             duplicates=()):
+    """``duplicates`` are the filmstrip_duplicates of the page, their links go to the frame stored instead."""
+    with timings.phase("update_page_results_html", page_name or None):
+        return get_link_rewriter(report_bucket, static_bucket, page_name, timestamp, loops, prefix,
+                                 duplicates).rewrite(html)
+
+
+@lru_cache(maxsize=32)
+def get_link_rewriter(report_bucket, static_bucket, page_name, timestamp, loops, prefix, duplicates=()):
+    s3_params = f'integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}'
+    replacements = [
+        (f'<li><a href="{prefix}assets.html">Assets</a></li>',
+         f'<li><a href="{report_bucket}/{timestamp}_assets.html?{s3_params}">Assets</a></li> '
+         f'<li><a href="{timestamp}_distributed_report.zip?{s3_params}">Report</a></li>')
+    ]
+    for attr, static_file in [("href", "css/index.min.css"), ("href", "img/ico/sitespeed.io-144.png"),
+                              ("href", "img/ico/sitespeed.io-114.png"), ("href", "img/ico/sitespeed.io-72.png"),
+                              ("href", "img/ico/sitespeed.io.ico"), ("src", "img/sitespeed.io-logo.png"),
+                              ("src", "img/coach.png"), ("src", "js/perf-cascade.min.js"),
+                              ("src", "js/sortable.min.js"), ("src", "js/chartist.min.js"),
+                              ("src", "js/chartist-plugin-axistitle.min.js"),
+                              ("src", "js/chartist-plugin-tooltip.min.js"), ("src", "js/chartist-plugin-legend.min.js"),
+                              ("src", "js/video.core.novtt.min.js")]:
+        replacements.append((f'{attr}="{prefix}{static_file}"',
+                             f'{attr}="{static_bucket}/{static_file.split("/")[-1]}?{s3_params}"'))
+    replacements.append((f'href="{prefix}help.html', f'href="{report_bucket}/{timestamp}_help.html?{s3_params}'))
 
     for html_file in ["index.html", "detailed.html", "pages.html", "domains.html", "toplist.html", "settings.html"]:
-        html = html.replace(f'href="{prefix}{html_file}"', f'href="{report_bucket}/{timestamp}_{html_file}?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"') if "integration_id" not in f'href="{prefix}{html_file}"' else html
+        replacements.append((f'href="{prefix}{html_file}"',
+                             f'href="{report_bucket}/{timestamp}_{html_file}?{s3_params}"'))
     for i in range(1, loops + 1):
-        html = html.replace(f'href="./{i}.html"', f'href="{report_bucket}/{page_name}_{timestamp}_{i}.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"') if "integration_id" not in f'href="./{i}.html"' else html
-        for data_file_path in [f"data/screenshots/{i}/", "data/video/", f"data/filmstrip/{i}/"]:
-            html = html.replace(data_file_path, f'{report_bucket}/{page_name}_{timestamp}_') if "integration_id" not in data_file_path else html
-    html = html.replace('href="metrics.html"', f'href="{report_bucket}/{page_name}_{timestamp}_metrics.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"')
+        replacements.append((f'href="./{i}.html"', f'href="{report_bucket}/{page_name}_{timestamp}_{i}.html?{s3_params}"'))
+        # ahead of the data/filmstrip/{i}/ prefix, which would otherwise take the duplicate frame links
+        for loop, name, stored in duplicates:
+            if loop == i:
+                replacements.append((f"data/filmstrip/{i}/{name}",
+                                     f'{report_bucket}/{page_name}_{timestamp}_{i}_{stored}'))
+        # frames and screenshots of different loops have the same names, videos are named after their loop
+        for data_file_path, loop_prefix in [(f"data/screenshots/{i}/", f"{i}_"), ("data/video/", ""),
+                                            (f"data/filmstrip/{i}/", f"{i}_")]:
+            replacements.append((data_file_path, f'{report_bucket}/{page_name}_{timestamp}_{loop_prefix}'))
+    replacements.append(('href="metrics.html"', f'href="{report_bucket}/{page_name}_{timestamp}_metrics.html?{s3_params}"'))
+    replacements = [(old, new) for old, new in replacements if "integration_id" not in old]
 
     # Links for pages
-    links = re.findall('href="pages/(.+?)/index.html"', html)
-    for each in links:
-        try:
-            link = f'href="pages/{each}/index.html"'
-            page_name = link.split("/")[-2]
-            html = html.replace(f'href="pages/{each}/index.html"',
-                                f'href="{report_bucket}/{page_name}_{timestamp}_index.html?integration_id={s3_config["integration_id"]}&is_local={s3_config["is_local"]}"') if "integration_id" not in f'href="pages/{each}/index.html"' else html
-        except:
-            print(f"failed to update {each} link")
-    return html
+    def page_link(each):
+        if "integration_id" in f'href="pages/{each}/index.html"':
+            return None
+        linked_page = f'href="pages/{each}/index.html"'.split("/")[-2]
+        return f'href="{report_bucket}/{linked_page}_{timestamp}_index.html?{s3_params}"'
+
+    return LinkRewriter(replacements, page_link)
 
 
-def upload_distributed_report(timestamp, galloper_url, project_id, token):
-    shutil.make_archive(base_name=f'{timestamp}_distributed_report', format="zip", root_dir="/",
-                        base_dir="/sitespeed.io/sitespeed-result")
-    upload_file(f'{timestamp}_distributed_report.zip', "/sitespeed.io/", galloper_url, project_id, token)
+def upload_distributed_report(timestamp, galloper_url, project_id, token, bucket="reports", entries=None):
+    # the tree is listed up front, the archive itself is built while it is being uploaded
+    if entries is None:
+        entries = list_archive_entries(SITESPEED_RESULTS)
+    return uploader.submit_stream(f"{galloper_url}/api/v1/artifacts/artifacts/{project_id}/{bucket}",
+                                  f'{timestamp}_distributed_report.zip',
+                                  lambda: timings.timed_chunks("upload_distributed_report", stream_archive(entries)),
+                                  params=s3_config, headers={'Authorization': f"Bearer {token}"},
+                                  priority=PRIORITY_BULK)
 
 
-def update_test_results(test_name, galloper_url, project_id, token, report_id, records):
+def update_test_results(test_name, galloper_url, project_id, token, report_id, results_writer):
     bucket = test_name.replace("_", "").lower()
-    header = "timestamp,name,identifier,type,loop,load_time,dom,tti,fcp,lcp,cls,tbt,fvc,lvc,file_name\n".encode('utf-8')
-    with open(f"/tmp/{report_id}.csv", 'wb') as f:
-        f.write(header)
-        for each in records:
-            f.write(
-                f"{each['metrics']['timestamps']},{each['name']},{each['identifier']},{each['type']},{each['loop']},"
-                f"{each['metrics']['load_time']},{each['metrics']['dom_processing']},"
-                f"{each['metrics']['time_to_interactive']},{each['metrics']['first_contentful_paint']},"
-                f"{each['metrics']['largest_contentful_paint']},"
-                f"{each['metrics']['cumulative_layout_shift']},{each['metrics']['total_blocking_time']},"
-                f"{each['metrics']['first_visual_change']},{each['metrics']['last_visual_change']},"
-                f"{each['file_name']}\n".encode('utf-8'))
-
-    import gzip
-    import shutil
-    with open(f"/tmp/{report_id}.csv", 'rb') as f_in:
-        with gzip.open(f"/tmp/{report_id}.csv.gz", 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-
-    upload_file(f"{report_id}.csv.gz", "/tmp/", galloper_url, project_id, token, bucket=bucket)
+    # the CSV is complete and its size known, it goes out with a Content-Length
+    return uploader.submit_file(f"{galloper_url}/api/v1/artifacts/artifacts/{project_id}/{bucket}",
+                                results_writer.file_name, results_writer.close(), params=s3_config,
+                                headers={'Authorization': f"Bearer {token}"})
+
+
+def upload_timings(timestamp, galloper_url, project_id, token, bucket="reports"):
+    """Upload the timing summary of this run next to the report, once everything else is uploaded."""
+    summary = timings.summary(uploader.stats())
+    uploads = summary["uploads"]
+    print(f"Results processing took {summary['wall']}s, {summary['cpu'] + summary['children_cpu']:.2f}s CPU, "
+          f"{uploads['files']} files ({uploads['bytes']} bytes) uploaded at {uploads['bytes_per_second']} B/s")
+    data = json.dumps(summary).encode('utf-8')
+    uploader.submit(f"{galloper_url}/api/v1/artifacts/artifacts/{project_id}/{bucket}",
+                    f"{timestamp}_timings.json", data, params=s3_config, headers={'Authorization': f"Bearer {token}"})
+    if uploader.wait():
+        print("Timings failed to upload")
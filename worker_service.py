@@ -0,0 +1,168 @@
+"""Worker mode: one long-lived process runs test after test, instead of a container and interpreters per run.
+
+    python3 worker_service.py    (or the container started with ``worker`` as its command)
+
+POST /runs with a run descriptor queues a run, GET /runs lists the runs queued, running and finished:
+
+    {"test_id": "1", "script": "urls.txt", "loops": 3, "aggregation": "max",
+     "report_id": "5", "test_name": "smoke", "env": "stage", "artifact": "tests.zip"}
+
+report_id, test_name, env and artifact default to REPORT_ID, JOB_NAME, ENV and ARTIFACT. Runs go one at a time:
+the tests bundle is read, sitespeed.io runs in a child process and its results are processed here, so the upload
+and control sessions, the page workers, the thresholds and the static files manifest stay warm between runs.
+"""
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from threading import Lock, Thread
+from traceback import format_exc
+
+import results_processing
+from minio_tests_reader import read_tests, BUCKET, TEST
+from results_index import RESULTS_WATCH, RESULTS_WATCH_DONE, SITESPEED_RESULTS
+from util import control_plane, create_page_pool, timings, uploader
+
+WORKER_HOST = os.environ.get("WORKER_HOST", "127.0.0.1")
+WORKER_PORT = int(os.environ.get("WORKER_PORT", 8080))
+# how sitespeed.io is started, the script and options of the run are appended like launch.sh does
+SITESPEED_CMD = os.environ.get("SITESPEED_CMD", "/bin/bash /start.sh")
+CUSTOM_CMD = os.environ.get("custom_cmd", "")
+# finished runs listed by GET /runs
+WORKER_HISTORY = int(os.environ.get("WORKER_HISTORY", 100))
+REQUIRED = ["test_id", "script", "loops", "aggregation"]
+OPTIONAL = ["report_id", "test_name", "env", "artifact"]
+
+
+class Worker(object):
+    """Runs the queued run descriptors one after the other, ``runs`` keeps their status."""
+
+    def __init__(self, page_pool=None):
+        self.page_pool = page_pool
+        self.queue = Queue()
+        self.lock = Lock()
+        self.runs = []
+        self.last_id = 0
+
+    def submit(self, descriptor):
+        if not isinstance(descriptor, dict):
+            raise ValueError("A run descriptor is a JSON object")
+        missing = [key for key in REQUIRED if key not in descriptor]
+        if missing:
+            raise ValueError(f"The run descriptor misses {', '.join(missing)}")
+        unknown = [key for key in descriptor if key not in REQUIRED + OPTIONAL]
+        if unknown:
+            raise ValueError(f"Unknown run descriptor keys {', '.join(unknown)}")
+        descriptor["loops"] = int(descriptor["loops"])
+        with self.lock:
+            self.last_id += 1
+            run = {"id": self.last_id, "status": "queued", "descriptor": descriptor}
+            self.runs.append(run)
+            finished = [each for each in self.runs if each["status"] in ("done", "failed")]
+            for each in finished[:-WORKER_HISTORY]:
+                self.runs.remove(each)
+        self.queue.put(run)
+        print(f"Run {run['id']} queued: {json.dumps(descriptor)}")
+        return dict(run)
+
+    def list_runs(self):
+        with self.lock:
+            return [dict(run) for run in self.runs]
+
+    def update(self, run, **changes):
+        with self.lock:
+            run.update(changes)
+
+    def serve_forever(self):
+        while True:
+            run = self.queue.get()
+            start = time.perf_counter()
+            self.update(run, status="running")
+            try:
+                exit_code = self.run_test(**run["descriptor"])
+                self.update(run, status="done", exit_code=exit_code)
+            except Exception:
+                print(format_exc())
+                self.update(run, status="failed")
+            self.update(run, wall=round(time.perf_counter() - start, 3))
+            print(f"Run {run['id']} {run['status']} in {run['wall']}s")
+
+    def run_test(self, test_id, script, loops, aggregation, report_id=results_processing.REPORT_ID,
+                 test_name=results_processing.TEST_NAME, env=results_processing.ENV, artifact=TEST):
+        """What launch.sh does for a run, return the exit code of sitespeed.io."""
+        timings.reset()
+        uploader.reset_stats()
+        shutil.rmtree(SITESPEED_RESULTS, ignore_errors=True)
+        if all(a for a in [results_processing.URL, BUCKET, artifact]):
+            read_tests(timings, control_plane, test=artifact, report_id=report_id)
+            print("Scripts downloaded")
+        print("Start test")
+        command = shlex.split(SITESPEED_CMD) + [f"/{script}", "--multi", "-n", str(loops),
+                                                "--plugins.add", "analysisstorer"] + shlex.split(CUSTOM_CMD)
+        if RESULTS_WATCH and os.path.exists(RESULTS_WATCH_DONE):
+            os.remove(RESULTS_WATCH_DONE)
+        sitespeed = subprocess.Popen(command)
+        if RESULTS_WATCH:
+            # the results are processed while the test runs, like launch.sh does
+            Thread(target=self.mark_done, args=(sitespeed,), daemon=True).start()
+        else:
+            sitespeed.wait()
+            print("Test is done. Results processing...")
+        results_processing.main(test_id, script, loops, aggregation, report_id=report_id, test_name=test_name,
+                                env=env, page_pool=self.page_pool, reader_timings=None)
+        return sitespeed.wait()
+
+    @staticmethod
+    def mark_done(sitespeed):
+        sitespeed.wait()
+        print("Test is done. Results processing...")
+        open(RESULTS_WATCH_DONE, "w").close()
+
+
+class RunsHandler(BaseHTTPRequestHandler):
+    worker = None
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/runs":
+            return self.answer(404, {"error": "Not found"})
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            run = self.worker.submit(json.loads(body or b"{}"))
+        except ValueError as e:
+            return self.answer(400, {"error": str(e)})
+        self.answer(202, run)
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/runs":
+            return self.answer(404, {"error": "Not found"})
+        self.answer(200, self.worker.list_runs())
+
+    def answer(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        # runs are polled, submitted and finished runs are printed by the worker
+        pass
+
+
+def main():
+    # the page workers are forked before any thread is started
+    worker = Worker(create_page_pool())
+    RunsHandler.worker = worker
+    server = ThreadingHTTPServer((WORKER_HOST, WORKER_PORT), RunsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Worker is waiting for runs on {WORKER_HOST}:{WORKER_PORT}")
+    worker.serve_forever()
+
+
+if __name__ == "__main__":
+    main()